@@ -0,0 +1,216 @@
+import asyncio
+import csv
+import itertools
+import json
+import os
+import time
+import zlib
+from pathlib import Path
+import numpy as np
+from openai import AsyncOpenAI, RateLimitError
+from dotenv import load_dotenv
+
+load_dotenv()
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# CSVの列は「cell＋グリッドのキー」の後にこれらを続ける
+RESULT_FIELDS = ["sample", "text"]
+SUMMARY_FIELDS = ["samples", "distinct_1", "distinct_2", "mean_pairwise_similarity"]
+
+# サンプリングパラメータとしてAPIに渡さないグリッドのキー
+NON_SAMPLING_KEYS = ("cell", "model", "prompt")
+
+# グリッドに使えないキー（run_cellが指定するAPIの引数と、CSVの列名）
+RESERVED_KEYS = {"cell", "n", "messages", "stream", *RESULT_FIELDS, *SUMMARY_FIELDS}
+
+class RateLimiter:
+    """1分あたりのリクエスト数を制限する（一定間隔で許可を出す）"""
+
+    def __init__(self, requests_per_minute=60):
+        self.interval = 60 / requests_per_minute
+        self.next_time = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+def expand_grid(grid):
+    """{"temperature": [0.1, 1], ...} をパラメータの組み合わせのリストに展開"""
+    keys = list(grid)
+    cells = []
+    for values in itertools.product(*(grid[k] for k in keys)):
+        params = dict(zip(keys, values))
+        params["cell"] = zlib.crc32(json.dumps(params, sort_keys=True, ensure_ascii=False).encode())
+        cells.append(params)
+    return cells
+
+def distinct_n(texts, n):
+    """distinct-n: 全n-gramのうちユニークなものの割合（日本語のため文字単位）"""
+    ngrams = [t[i:i + n] for t in texts for i in range(len(t) - n + 1)]
+    return len(set(ngrams)) / len(ngrams) if ngrams else 0.0
+
+def mean_pairwise_similarity(texts, dim=1024):
+    """文字バイグラムのハッシュベクトルで全ペアのコサイン類似度を行列積で求め、平均を返す"""
+    if len(texts) < 2:
+        return None
+    rows, cols = [], []
+    for row, text in enumerate(texts):
+        for i in range(len(text) - 1):
+            rows.append(row)
+            cols.append(zlib.crc32(text[i:i + 2].encode()) % dim)
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    np.add.at(vectors, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    similarity = vectors @ vectors.T
+    upper = similarity[np.triu_indices(len(texts), k=1)]
+    return float(upper.mean())
+
+async def run_cell(params, samples, limiter, semaphore, retries=5):
+    """1つのパラメータの組み合わせをn=samplesで1回のリクエストとして実行"""
+    async with semaphore:
+        for attempt in range(retries):
+            await limiter.wait()
+            try:
+                # model と prompt 以外のキー（temperature, top_p, seed など）はすべてそのまま渡す
+                sampling = {k: v for k, v in params.items() if k not in NON_SAMPLING_KEYS}
+                response = await client.chat.completions.create(
+                    model=params["model"],
+                    messages=[{"role": "user", "content": params["prompt"]}],
+                    n=samples,
+                    **sampling
+                )
+                return [choice.message.content for choice in response.choices]
+            except RateLimitError:
+                await asyncio.sleep(min(2 ** attempt, 60))
+    raise RuntimeError(f"リトライ回数を超過しました: {params}")
+
+def load_completed(path):
+    """中断したスイープを再開するため、完了済みのセルを読み込む"""
+    if not Path(path).exists():
+        return set()
+    with open(path, encoding="utf-8", newline="") as f:
+        return {int(row["cell"]) for row in csv.DictReader(f)}
+
+def check_header(path, fields):
+    """既存のCSVの列が今回のグリッドの列と一致するか確認する（違うグリッドで再開すると列がずれるため）"""
+    if not Path(path).exists():
+        return
+    with open(path, encoding="utf-8", newline="") as f:
+        header = next(csv.reader(f), None)
+    if header is not None and header != fields:
+        raise ValueError(f"{path} の列 {header} が今回のグリッドの列 {fields} と一致しません"
+                         "（グリッドを変えた場合は別のoutput_dirを指定してください）")
+
+def drop_unfinished_rows(path, completed):
+    """summaryに記録されていないセルの行を削除する（途中で止まったセルは再実行で書き直すため）"""
+    path = Path(path)
+    if not path.exists():
+        return 0
+    dropped = 0
+    tmp_path = path.with_suffix(".tmp")
+    with open(path, encoding="utf-8", newline="") as src, \
+         open(tmp_path, "w", encoding="utf-8", newline="") as dst:
+        reader = csv.DictReader(src)
+        writer = csv.DictWriter(dst, fieldnames=reader.fieldnames or [])
+        if reader.fieldnames:
+            writer.writeheader()
+        for row in reader:
+            if int(row["cell"]) in completed:
+                writer.writerow(row)
+            else:
+                dropped += 1
+    if dropped:
+        os.replace(tmp_path, path)
+    else:
+        tmp_path.unlink()
+    return dropped
+
+def open_csv(path, fields):
+    """追記モードでCSVを開く（新規作成時はヘッダーを書く）"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    is_new = not path.exists() or path.stat().st_size == 0
+    f = open(path, "a", encoding="utf-8", newline="")
+    writer = csv.DictWriter(f, fieldnames=fields)
+    if is_new:
+        writer.writeheader()
+    return f, writer
+
+async def sweep(grid, samples=3, output_dir="./tmp/sweep", requests_per_minute=60, max_concurrency=8):
+    """パラメータグリッドを並列に実行し、結果と多様性指標をCSVへ書き出す"""
+    results_path = Path(output_dir) / "results.csv"
+    summary_path = Path(output_dir) / "summary.csv"
+
+    reserved = sorted(RESERVED_KEYS & set(grid))
+    if reserved:
+        raise ValueError(f"グリッドに使えないキーです: {reserved}（サンプル数は samples で指定してください）")
+    keys = ["cell", *grid]
+    check_header(results_path, keys + RESULT_FIELDS)
+    check_header(summary_path, keys + SUMMARY_FIELDS)
+
+    cells = expand_grid(grid)
+    completed = load_completed(summary_path)
+    # 前回、結果の行を書いた後でsummaryを書く前に止まったセルの行は、再実行で重複しないよう消す
+    dropped = drop_unfinished_rows(results_path, completed)
+    pending = [c for c in cells if c["cell"] not in completed]
+    print(f"全{len(cells)}セル（完了済み {len(cells) - len(pending)}、実行 {len(pending)}、"
+          f"未完了セルの行を削除 {dropped}）")
+
+    limiter = RateLimiter(requests_per_minute)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    results_file, results_writer = open_csv(results_path, keys + RESULT_FIELDS)
+    summary_file, summary_writer = open_csv(summary_path, keys + SUMMARY_FIELDS)
+
+    async def run_and_record(params):
+        texts = await run_cell(params, samples, limiter, semaphore)
+        base = {k: params[k] for k in keys}
+        for i, text in enumerate(texts):
+            results_writer.writerow({**base, "sample": i, "text": text})
+        results_file.flush()
+        # summaryの書き込みをセル完了の印とする（途中で止まったセルの行は再開時に消して再実行する）
+        summary_writer.writerow({
+            **base,
+            "samples": len(texts),
+            "distinct_1": distinct_n(texts, 1),
+            "distinct_2": distinct_n(texts, 2),
+            "mean_pairwise_similarity": mean_pairwise_similarity(texts),
+        })
+        summary_file.flush()
+
+    try:
+        outcomes = await asyncio.gather(*(run_and_record(c) for c in pending), return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                print(f"エラー: {outcome}")
+    finally:
+        results_file.close()
+        summary_file.close()
+
+    return summary_path
+
+# 使用例
+if __name__ == "__main__":
+    grid = {
+        "model": ["gpt-4.1-nano"],
+        "prompt": [
+            "AIツールのキャッチコピーを1つ作成してください。",
+            "冬をテーマにした俳句を1つ作成して1行で表示してください。",
+        ],
+        "temperature": [0.1, 0.5, 1],
+        "top_p": [0.1, 0.5, 1],
+    }
+
+    summary_path = asyncio.run(sweep(grid, samples=3))
+
+    print(f"\n=== 多様性指標（{summary_path}） ===")
+    with open(summary_path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            print(f"temperature={row['temperature']}, top_p={row['top_p']}: "
+                  f"distinct-2={float(row['distinct_2']):.2f}, "
+                  f"類似度={row['mean_pairwise_similarity']} | {row['prompt'][:15]}...")
@@ -1,9 +1,113 @@
 from dotenv import load_dotenv
+import hashlib
+import json
 import os
+from pathlib import Path
 from openai import OpenAI
 
 load_dotenv()
 
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# キャッシュを有効にするには、これらのサンプリングパラメータを明示的に固定する必要がある
+PINNED_PARAMS = ("seed", "temperature", "top_p")
+
+class DeterministicCache:
+    """seed付きリクエストの結果をsystem_fingerprintと一緒に保存するキャッシュ
+
+    同じリクエスト・同じバックエンド構成（system_fingerprint）であれば
+    同じ出力が得られることを前提に、APIを呼ばずに保存済みの結果を返します。
+    """
+
+    def __init__(self, cache_file="./tmp/seed_cache.json"):
+        self.cache_file = Path(cache_file)
+        self.entries = {}
+        self.fingerprints = {}  # モデルごとに最後に観測したsystem_fingerprint
+        self.verified = set()  # このプロセスでfingerprintを確認済みのモデル
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        """保存済みのキャッシュを読み込む"""
+        if self.cache_file.exists():
+            try:
+                data = json.loads(self.cache_file.read_text())
+                self.entries = data.get("entries", {})
+                self.fingerprints = data.get("fingerprints", {})
+            except (json.JSONDecodeError, OSError):
+                pass
+
+    def _save(self):
+        """キャッシュを保存"""
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        data = {"fingerprints": self.fingerprints, "entries": self.entries}
+        self.cache_file.write_text(json.dumps(data, ensure_ascii=False, indent=2))
+
+    @staticmethod
+    def is_cacheable(params):
+        """サンプリングパラメータがすべて固定されている場合のみキャッシュ対象"""
+        if params.get("stream") or params.get("n", 1) != 1:
+            return False
+        return all(params.get(name) is not None for name in PINNED_PARAMS)
+
+    @staticmethod
+    def make_key(params):
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def observe(self, model, fingerprint):
+        """APIから返ったfingerprintを記録（変化した場合は古いエントリが無効になる）
+
+        Noneも記録する（構成が確認できない間は、保存済みのどのエントリとも一致させない）
+        """
+        previous = self.fingerprints.get(model)
+        if previous != fingerprint:
+            if previous is not None and fingerprint is not None:
+                print(f"system_fingerprintが変化しました: {previous} -> {fingerprint}")
+            self.fingerprints[model] = fingerprint
+
+    def refresh_fingerprint(self, client, model):
+        """1トークンだけ生成して現在のsystem_fingerprintを確認（create()が最初のヒット前に呼ぶ）"""
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": "ping"}],
+            max_completion_tokens=1
+        )
+        self.observe(model, response.system_fingerprint)
+        self.verified.add(model)
+        self._save()
+
+    def create(self, client, **params):
+        """chat.completions.createの代わりに呼び出し、本文とfingerprintを返す"""
+        if not self.is_cacheable(params):
+            response = client.chat.completions.create(**params)
+            return response.choices[0].message.content, response.system_fingerprint
+
+        key = self.make_key(params)
+        entry = self.entries.get(key)
+        # 保存済みの結果を初めて返す前に、バックエンドが変わっていないかをプロセスごとに1回確認する
+        if entry is not None and params["model"] not in self.verified:
+            self.refresh_fingerprint(client, params["model"])
+        current = self.fingerprints.get(params["model"])
+        if entry is not None and current is not None and entry["system_fingerprint"] == current:
+            self.hits += 1
+            return entry["content"], entry["system_fingerprint"]
+
+        self.misses += 1
+        response = client.chat.completions.create(**params)
+        fingerprint = response.system_fingerprint
+        self.observe(params["model"], fingerprint)
+        self.verified.add(params["model"])
+        content = response.choices[0].message.content
+        # fingerprintがない応答は、同じ構成で生成されたかを後で確認できないため保存しない
+        if fingerprint is not None:
+            self.entries[key] = {"content": content, "system_fingerprint": fingerprint}
+        self._save()
+        return content, fingerprint
+
+cache = DeterministicCache()
+
 def consistent_generation(prompt, seed_value=12345):
     """
     同じ入力に対して毎回同じ出力を得る関数
@@ -16,16 +120,16 @@ def consistent_generation(prompt, seed_value=12345):
         str: AI生成のレスポンス
     """
 
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    response = client.chat.completions.create(
+    content, _ = cache.create(
+        client,
         model="gpt-4.1-nano",
         messages=[{"role": "user", "content": prompt}],
         seed=seed_value,
-        temperature=0.7
+        temperature=0.7,
+        top_p=1
     )
 
-    return response.choices[0].message.content
+    return content
 
 # 使用例
 if __name__ == "__main__":
@@ -33,6 +137,7 @@ if __name__ == "__main__":
     prompt = "短い詩を1つ書いてください"
 
     # 同じシード値で複数回実行すると同じ結果が得られる
+    # 2回目以降はキャッシュから返るため、APIは呼ばれない
     result1 = consistent_generation(prompt)
     result2 = consistent_generation(prompt)
 
@@ -40,3 +145,4 @@ if __name__ == "__main__":
     print(result1)
     print("\n2回目の結果:")
     print(result2)
+    print(f"\nキャッシュ ヒット: {cache.hits}回, ミス: {cache.misses}回")
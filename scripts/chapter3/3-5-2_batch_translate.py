@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import sqlite3
+from pathlib import Path
+import tiktoken
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# 複数セグメントをまとめて返させるためのスキーマ
+TRANSLATION_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "batch_translation",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "translations": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "text": {"type": "string"}
+                        },
+                        "required": ["id", "text"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["translations"],
+            "additionalProperties": False
+        }
+    }
+}
+
+class TranslationMemory:
+    """(原文, 文脈, モデル) をキーに翻訳結果を保存する永続キャッシュ"""
+
+    def __init__(self, db_path="./tmp/translation_memory.sqlite3"):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS memory (
+                segment TEXT NOT NULL,
+                context TEXT NOT NULL,
+                model TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                PRIMARY KEY (segment, context, model)
+            )
+        """)
+
+    def lookup(self, segments, context, model):
+        """登録済みの翻訳を {原文: 訳文} で返す"""
+        found = {}
+        segments = list(segments)
+        # SQLiteのプレースホルダ数の上限を超えないよう分割して問い合わせる
+        for i in range(0, len(segments), 500):
+            batch = segments[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT segment, translation FROM memory "
+                f"WHERE context = ? AND model = ? AND segment IN ({placeholders})",
+                [context, model, *batch]
+            )
+            found.update(rows)
+        return found
+
+    def store(self, translations, context, model):
+        """翻訳結果をまとめて保存"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO memory VALUES (?, ?, ?, ?)",
+                [(s, context, model, t) for s, t in translations.items()]
+            )
+
+def pack_batches(segments, model, max_tokens_per_batch=1500, max_segments_per_batch=100):
+    """トークン数の予算内に収まるようにセグメントをバッチへ詰める"""
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+
+    batches = []
+    current, current_tokens = [], 0
+    for segment in segments:
+        tokens = len(encoding.encode(segment)) + 8  # JSONの区切り分を加算
+        if current and (current_tokens + tokens > max_tokens_per_batch
+                        or len(current) >= max_segments_per_batch):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(segment)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+async def translate_batch(segments, context, model, semaphore):
+    """1リクエストで複数セグメントを翻訳し、{原文: 訳文}を返す"""
+    items = [{"id": i, "text": s} for i, s in enumerate(segments)]
+    prompt = f"""
+以下のJSON配列の各textを日本語へ翻訳し、同じidで返してください。
+
+文脈情報: {context}
+
+翻訳時の注意点:
+- 原文の意図とニュアンスを保持する
+- 専門用語は適切に扱う
+- 要素を結合・分割せず、すべてのidを1件ずつ返す
+
+翻訳対象:
+{json.dumps(items, ensure_ascii=False)}
+"""
+    async with semaphore:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            response_format=TRANSLATION_SCHEMA,
+            temperature=0.2
+        )
+
+    translations = json.loads(response.choices[0].message.content)["translations"]
+    return {
+        segments[t["id"]]: t["text"]
+        for t in translations
+        if isinstance(t.get("id"), int) and 0 <= t["id"] < len(segments)
+    }
+
+async def batch_translate(texts, context="", model="gpt-4.1-nano", memory=None,
+                          max_tokens_per_batch=1500, max_concurrency=8):
+    """重複排除・翻訳メモリ・バッチ化・並列実行を組み合わせた一括翻訳
+
+    Returns:
+        tuple[list[str | None], dict]: 入力順の訳文リストと統計情報
+    """
+    unique = list(dict.fromkeys(texts))  # 入力順を保ったまま重複を除去
+    cached = memory.lookup(unique, context, model) if memory is not None else {}
+    pending = [s for s in unique if s not in cached]
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    translated = {}
+    requests = 0
+    # 返ってこなかったセグメントは1回だけ小さいバッチで再送する
+    for attempt in range(2):
+        if not pending:
+            break
+        batches = pack_batches(pending, model, max_tokens_per_batch if attempt == 0 else 200)
+        results = await asyncio.gather(
+            *(translate_batch(b, context, model, semaphore) for b in batches),
+            return_exceptions=True
+        )
+        requests += len(batches)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"エラー: {result}")
+                continue
+            translated.update(result)
+        pending = [s for s in pending if s not in translated]
+
+    if memory is not None and translated:
+        memory.store(translated, context, model)
+
+    lookup = {**cached, **translated}
+    stats = {
+        "segments": len(texts),
+        "unique": len(unique),
+        "memory_hits": len(cached),
+        "translated": len(translated),
+        "failed": len(pending),
+        "requests": requests,
+    }
+    return [lookup.get(t) for t in texts], stats
+
+async def main():
+    """取扱説明書の短い文言をまとめて翻訳する"""
+    manual = [
+        "Press the power button.",
+        "Disconnect the power supply before maintenance.",
+        "Press the power button.",
+        "Wear protective gloves.",
+        "Warning",
+        "Warning",
+        "Check that all moving parts have come to a complete stop.",
+        "Press the power button.",
+    ]
+
+    memory = TranslationMemory()
+    context = "機械の取扱説明書です。ビジネス文書風で翻訳してください。"
+
+    # 1回目: 重複を除いた未翻訳セグメントだけをバッチでAPIに送信
+    results, stats = await batch_translate(manual, context, memory=memory)
+    for source, target in zip(manual, results):
+        print(f"{source} => {target}")
+    print(f"統計: {stats}")
+
+    # 2回目: 翻訳メモリから取得されるためAPI呼び出しは0回
+    _, stats = await batch_translate(manual, context, memory=memory)
+    print(f"統計（2回目）: {stats}")
+
+# 使用例
+if __name__ == "__main__":
+    asyncio.run(main())
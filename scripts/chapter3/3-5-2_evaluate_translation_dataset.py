@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from openai import AsyncOpenAI, RateLimitError
+from dotenv import load_dotenv
+
+load_dotenv()
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+CRITERIA = ["accuracy", "fluency", "completeness"]
+
+RUBRIC = """
+以下の翻訳を5段階（1:低品質 〜 5:高品質）で評価してください。
+
+評価項目:
+1. accuracy: 意味の正確性（1-5）
+2. fluency: 表現の自然さ（1-5）
+3. completeness: 情報の完全性（1-5）
+4. suggestions: 改善提案（文字列）
+"""
+
+# 評価結果をスキーマで固定し、自由文のJSONパース失敗をなくす
+EVALUATION_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "translation_evaluation",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                **{c: {"type": "integer", "enum": [1, 2, 3, 4, 5]} for c in CRITERIA},
+                "suggestions": {"type": "string"}
+            },
+            "required": [*CRITERIA, "suggestions"],
+            "additionalProperties": False
+        }
+    }
+}
+
+class GradeCache:
+    """(原文, 翻訳, ルーブリック, モデル) をキーに評価結果を保存するキャッシュ"""
+
+    def __init__(self, db_path="./tmp/translation_grades.sqlite3"):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS grades (key TEXT PRIMARY KEY, result TEXT NOT NULL)"
+        )
+
+    @staticmethod
+    def make_key(original, translated, rubric, model):
+        payload = json.dumps([original, translated, rubric, model], ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT result FROM grades WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, result):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO grades VALUES (?, ?)",
+                (key, json.dumps(result, ensure_ascii=False))
+            )
+
+class RunningStats:
+    """評価結果の集計を逐次更新する"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.sums = {c: 0 for c in CRITERIA}
+        self.histograms = {c: [0] * 5 for c in CRITERIA}
+        self.start_time = time.perf_counter()
+
+    def add(self, result, cached):
+        if "error" in result:
+            self.errors += 1
+            return
+        self.count += 1
+        self.cache_hits += cached
+        for c in CRITERIA:
+            self.sums[c] += result[c]
+            self.histograms[c][result[c] - 1] += 1
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start_time
+        done = self.count + self.errors
+        return {
+            "graded": self.count,
+            "errors": self.errors,
+            "cache_hits": self.cache_hits,
+            "mean": {c: round(self.sums[c] / self.count, 3) if self.count else None for c in CRITERIA},
+            "histogram": self.histograms,
+            "pairs_per_hour": round(done / elapsed * 3600) if elapsed > 0 else None,
+        }
+
+async def grade_pair(original, translated, model, rubric, retries=5):
+    """1組の翻訳を評価（レート制限時は指数バックオフでリトライ）"""
+    prompt = f"{rubric}\n原文: {original}\n翻訳: {translated}\n"
+    for attempt in range(retries):
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                response_format=EVALUATION_SCHEMA,
+                temperature=0
+            )
+            return json.loads(response.choices[0].message.content)
+        except RateLimitError:
+            await asyncio.sleep(min(2 ** attempt, 60))
+    return {"error": "リトライ回数を超過しました"}
+
+def read_pairs(path):
+    """JSONLファイルから {"original": ..., "translated": ...} を1行ずつ読み込む
+
+    読めない行は例外にせず {"error": ...} を返し、その行だけをエラーとして記録する
+    """
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                pair = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {"error": f"{lineno}行目をJSONとして読めません: {e}"}
+                continue
+            if isinstance(pair, dict):
+                yield pair
+            else:
+                yield {"error": f"{lineno}行目がオブジェクトではありません"}
+
+async def evaluate_dataset(input_path, output_path, model="gpt-4.1-nano", rubric=RUBRIC,
+                           concurrency=32, cache=None, report_every=100):
+    """JSONLの翻訳ペアを並列に評価し、結果をJSONLへ書き出しながら集計する"""
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    stats = RunningStats()
+
+    async def worker(out):
+        while True:
+            item = await queue.get()
+            if item is None:
+                queue.task_done()
+                return
+            index, pair = item
+            try:
+                cached = False
+                try:
+                    if "error" in pair:
+                        result = {"error": pair["error"]}  # 読み込めなかった行
+                    else:
+                        key = GradeCache.make_key(pair["original"], pair["translated"], rubric, model)
+                        result = cache.get(key) if cache is not None else None
+                        cached = result is not None
+                        if not cached:
+                            result = await grade_pair(pair["original"], pair["translated"], model, rubric)
+                            if cache is not None and "error" not in result:
+                                cache.set(key, result)
+                except Exception as e:
+                    result = {"error": f"評価エラー: {str(e)}"}
+
+                stats.add(result, cached)
+                out.write(json.dumps({"index": index, **pair, **result}, ensure_ascii=False) + "\n")
+                done = stats.count + stats.errors
+                if done % report_every == 0:
+                    print(f"[{done}件] {stats.summary()}")
+            finally:
+                queue.task_done()
+
+    with open(output_path, "w", encoding="utf-8") as out:
+        workers = [asyncio.create_task(worker(out)) for _ in range(concurrency)]
+        # 大きなファイルでも全件をメモリに載せないよう、キュー経由で少しずつ流す
+        try:
+            for index, pair in enumerate(read_pairs(input_path)):
+                await queue.put((index, pair))
+        finally:
+            # 読み込みが途中で失敗しても、ワーカーを止めてから例外を伝える
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+    return stats.summary()
+
+async def main():
+    """サンプルの翻訳ペアを評価する（引数で入力JSONLを指定可能）"""
+    if len(sys.argv) > 1:
+        input_path = sys.argv[1]
+    else:
+        input_path = "./tmp/translation_pairs.jsonl"
+        samples = [
+            {"original": "The system requires immediate attention.", "translated": "システムには即座の注意が必要です。"},
+            {"original": "Please disconnect the power supply.", "translated": "電源を切断してください。"},
+            {"original": "Always wear protective gloves.", "translated": "手袋をしてください。"},
+        ]
+        Path(input_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(input_path).write_text(
+            "".join(json.dumps(s, ensure_ascii=False) + "\n" for s in samples), encoding="utf-8"
+        )
+
+    summary = await evaluate_dataset(
+        input_path,
+        "./tmp/translation_grades.jsonl",
+        cache=GradeCache(),
+        report_every=1
+    )
+    print(f"\n評価結果の集計: {json.dumps(summary, ensure_ascii=False, indent=2)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,174 @@
+import asyncio
+import bisect
+import os
+import time
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# チャンク間隔ヒストグラムの区切り（ミリ秒）
+GAP_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000]
+
+class StreamMetrics:
+    """1本のストリームのレイテンシを計測"""
+
+    def __init__(self, stream_id):
+        self.stream_id = stream_id
+        self.start_time = time.perf_counter()
+        self.first_chunk_time = None
+        self.last_chunk_time = None
+        self.end_time = None
+        self.chunk_count = 0
+        self.completion_tokens = None  # usageが返ってきた場合のみ設定
+        self.gap_histogram = [0] * (len(GAP_BUCKETS_MS) + 1)
+        self.cancelled = False
+
+    def on_chunk(self):
+        """チャンク受信時刻を記録"""
+        now = time.perf_counter()
+        if self.first_chunk_time is None:
+            self.first_chunk_time = now
+        else:
+            gap_ms = (now - self.last_chunk_time) * 1000
+            self.gap_histogram[bisect.bisect_left(GAP_BUCKETS_MS, gap_ms)] += 1
+        self.last_chunk_time = now
+        self.chunk_count += 1
+
+    @property
+    def ttft(self):
+        """最初のトークンが届くまでの時間（秒）"""
+        if self.first_chunk_time is None:
+            return None
+        return self.first_chunk_time - self.start_time
+
+    @property
+    def tokens_per_sec(self):
+        """最初のトークン以降の出力速度（トークン/秒）"""
+        if self.first_chunk_time is None or self.end_time is None:
+            return None
+        duration = self.end_time - self.first_chunk_time
+        tokens = self.completion_tokens or self.chunk_count
+        return tokens / duration if duration > 0 else None
+
+    def histogram_labels(self):
+        """ヒストグラムを「区間: 件数」の形式で返す"""
+        labels = [f"<{GAP_BUCKETS_MS[0]}ms"]
+        labels += [f"{lo}-{hi}ms" for lo, hi in zip(GAP_BUCKETS_MS, GAP_BUCKETS_MS[1:])]
+        labels.append(f">={GAP_BUCKETS_MS[-1]}ms")
+        return dict(zip(labels, self.gap_histogram))
+
+    def summary(self):
+        """計測結果を辞書で返す"""
+        return {
+            "stream_id": self.stream_id,
+            "ttft": self.ttft,
+            "tokens_per_sec": self.tokens_per_sec,
+            "chunks": self.chunk_count,
+            "completion_tokens": self.completion_tokens,
+            "gap_histogram": self.histogram_labels(),
+            "cancelled": self.cancelled,
+        }
+
+class StreamingMultiplexer:
+    """1つのイベントループで複数のストリーミング応答を同時に処理する"""
+
+    def __init__(self, client, model="gpt-5-nano", max_concurrency=32, max_completion_tokens=3000):
+        self.client = client
+        self.model = model
+        self.max_completion_tokens = max_completion_tokens
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks = {}
+        self.metrics = {}
+
+    def start(self, stream_id, prompt, on_delta=None):
+        """ストリームを開始してタスクを返す（on_delta(stream_id, text)で差分を受け取れる）"""
+        self.metrics[stream_id] = StreamMetrics(stream_id)
+        task = asyncio.create_task(self._run(stream_id, prompt, on_delta))
+        self._tasks[stream_id] = task
+        return task
+
+    def cancel(self, stream_id):
+        """クライアント側の中断。タスクをキャンセルすると上流のHTTP接続も閉じられる"""
+        task = self._tasks.get(stream_id)
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def _run(self, stream_id, prompt, on_delta):
+        metrics = self.metrics[stream_id]
+        parts = []
+        try:
+            async with self._semaphore:
+                # 計測はセマフォ待ちの後（実際にリクエストを送る時点）から開始
+                metrics.start_time = time.perf_counter()
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": "あなたは親切なアシスタントです。"},
+                        {"role": "user", "content": prompt}
+                    ],
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    max_completion_tokens=self.max_completion_tokens
+                )
+                # async withを抜けるとき（キャンセル時を含む）にレスポンスを閉じる
+                async with stream:
+                    async for chunk in stream:
+                        if chunk.usage is not None:
+                            metrics.completion_tokens = chunk.usage.completion_tokens
+                        if not chunk.choices or chunk.choices[0].delta.content is None:
+                            continue
+                        content = chunk.choices[0].delta.content
+                        metrics.on_chunk()
+                        parts.append(content)
+                        if on_delta is not None:
+                            on_delta(stream_id, content)
+        except asyncio.CancelledError:
+            metrics.cancelled = True
+            raise
+        finally:
+            metrics.end_time = time.perf_counter()
+        return "".join(parts)
+
+    async def gather(self):
+        """開始済みの全ストリームの完了を待つ（キャンセル・エラーはNone）"""
+        ids = list(self._tasks)
+        results = await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        return {
+            stream_id: None if isinstance(result, BaseException) else result
+            for stream_id, result in zip(ids, results)
+        }
+
+async def main():
+    """複数の質問を同時にストリーミングし、1本は途中でキャンセルする"""
+    prompts = {
+        "q1": "Pythonの特徴を3つ教えてください。",
+        "q2": "HTTPとHTTPSの違いを簡潔に説明してください。",
+        "q3": "日本の四季について長めに説明してください。",
+    }
+
+    mux = StreamingMultiplexer(client)
+    for stream_id, prompt in prompts.items():
+        mux.start(stream_id, prompt)
+
+    # q3はクライアント側で1秒後に中断
+    await asyncio.sleep(1.0)
+    mux.cancel("q3")
+
+    results = await mux.gather()
+
+    for stream_id, text in results.items():
+        stats = mux.metrics[stream_id].summary()
+        print(f"\n=== {stream_id} ===")
+        if text is None:
+            print("（キャンセルまたはエラー）")
+        else:
+            print(text)
+        ttft = f"{stats['ttft']:.2f}秒" if stats["ttft"] is not None else "-"
+        tps = f"{stats['tokens_per_sec']:.1f}" if stats["tokens_per_sec"] is not None else "-"
+        print(f"TTFT: {ttft} | トークン/秒: {tps} | チャンク数: {stats['chunks']}")
+        print(f"チャンク間隔: {stats['gap_histogram']}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
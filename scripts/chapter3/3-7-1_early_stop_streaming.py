@@ -0,0 +1,233 @@
+import os
+import re
+import time
+import tiktoken
+from openai import OpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+class StopCondition:
+    """ストリームの差分を受け取り、停止すべきかを判定する基底クラス
+
+    feed()には新しく届いた差分だけを渡すため、全文を毎回走査しません。
+    停止時はend（全文中の打ち切り位置）を設定します。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.length = 0
+        self.end = None
+
+    def feed(self, delta):
+        raise NotImplementedError
+
+    def finish(self):
+        """ストリームが最後まで届いたときに呼ぶ（保留中の判定があれば確定する）"""
+        return False
+
+class RegexStop(StopCondition):
+    """正規表現にマッチしたら停止（lookback文字だけ前から再検索する）"""
+
+    def __init__(self, pattern, lookback=64):
+        self.pattern = re.compile(pattern)
+        self.lookback = lookback
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        self.window = ""
+
+    def feed(self, delta):
+        offset = self.length - len(self.window)
+        self.window += delta
+        self.length += len(delta)
+        match = self.pattern.search(self.window)
+        # 末尾に接するマッチは続きの文字で変わり得るため（\bneutral\b と "neutrality" など）、
+        # 次の差分が届くまで確定しない
+        if match and match.end() < len(self.window):
+            self.end = offset + match.end()
+            return True
+        self.window = self.window[-self.lookback:]
+        return False
+
+    def finish(self):
+        offset = self.length - len(self.window)
+        match = self.pattern.search(self.window)
+        if match:
+            self.end = offset + match.end()
+            return True
+        return False
+
+class JsonObjectClosed(StopCondition):
+    """最初のJSONオブジェクトが閉じたら停止（文字列とエスケープを考慮）"""
+
+    def reset(self):
+        super().reset()
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, delta):
+        for i, ch in enumerate(delta):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.depth > 0:
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = self.length + i + 1
+                    self.length += len(delta)
+                    return True
+        self.length += len(delta)
+        return False
+
+class SentenceCount(StopCondition):
+    """指定した文数に達したら停止"""
+
+    def __init__(self, n, terminators="。！？!?"):
+        self.n = n
+        self.terminators = terminators
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        self.count = 0
+
+    def feed(self, delta):
+        for i, ch in enumerate(delta):
+            if ch in self.terminators:
+                self.count += 1
+                if self.count >= self.n:
+                    self.end = self.length + i + 1
+                    self.length += len(delta)
+                    return True
+        self.length += len(delta)
+        return False
+
+class EarlyStopStats:
+    """早期終了で節約できた出力トークン数（推定）を記録"""
+
+    def __init__(self):
+        self.requests = 0
+        self.stopped = 0
+        self.received_tokens = 0
+        self.saved_tokens = 0
+
+    def record(self, received, max_completion_tokens, stopped):
+        self.requests += 1
+        self.received_tokens += received
+        if stopped:
+            self.stopped += 1
+            # 打ち切らなければ最大でmax_completion_tokensまで生成され得た（上限からの推定値）
+            self.saved_tokens += max(max_completion_tokens - received, 0)
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "stopped": self.stopped,
+            "received_tokens": self.received_tokens,
+            "saved_tokens_estimate": self.saved_tokens,
+        }
+
+stats = EarlyStopStats()
+
+def count_tokens(text, model):
+    """受信したテキストのトークン数をトークナイザーで数える"""
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+    return len(encoding.encode(text))
+
+def streaming_chat_with_stop(prompt, stop, model="gpt-5-nano", max_completion_tokens=3000):
+    """停止条件を満たした時点でストリームを閉じるチャット
+
+    Args:
+        prompt (str): 入力プロンプト
+        stop (StopCondition | list[StopCondition]): いずれかを満たしたら停止
+        model (str): 使用するモデル
+        max_completion_tokens (int): 出力トークンの上限
+
+    Returns:
+        str: 停止位置までの回答
+    """
+    conditions = stop if isinstance(stop, list) else [stop]
+    for condition in conditions:
+        condition.reset()
+
+    parts = []
+    chunks = 0
+    usage = None
+    matched = None
+    start_time = time.time()
+
+    # withを抜けるとHTTPレスポンスが閉じられ、以降の生成は受信しない
+    with client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+        stream_options={"include_usage": True},
+        max_completion_tokens=max_completion_tokens
+    ) as stream:
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage  # 最後まで受信したときだけ届く
+            if not chunk.choices or chunk.choices[0].delta.content is None:
+                continue
+            content = chunk.choices[0].delta.content
+            parts.append(content)
+            chunks += 1
+            matched = next((c for c in conditions if c.feed(content)), None)
+            if matched is not None:
+                break
+
+    text = "".join(parts)
+    stopped = matched is not None
+    # 打ち切った場合はusageが届かないため、受信したテキストをトークナイザーで数える
+    received = usage.completion_tokens if usage is not None else count_tokens(text, model)
+    stats.record(received, max_completion_tokens, stopped)
+    if not stopped:
+        # 最後まで届いた場合は、末尾で保留していた判定を確定する
+        matched = next((c for c in conditions if c.finish()), None)
+    if matched is not None:
+        text = text[:matched.end]
+    if stopped:
+        print(f"（{type(matched).__name__}で停止: {chunks}チャンク・約{received}トークン, {time.time() - start_time:.1f}秒）")
+    return text
+
+# 使用例
+if __name__ == "__main__":
+    # 分類ラベルが出た時点で停止
+    label = streaming_chat_with_stop(
+        "次のレビューの感情を positive / negative / neutral のいずれかで答え、理由も説明してください：'配送が遅くて残念でした。'",
+        RegexStop(r"\b(positive|negative|neutral)\b")
+    )
+    print(f"分類結果: {label}\n")
+
+    # JSONオブジェクトが閉じた時点で停止
+    result = streaming_chat_with_stop(
+        '次の文章から人物名と年齢をJSONで抽出してください。出力形式: {"name": "...", "age": ...}\n文章: 山田太郎は25歳です。',
+        JsonObjectClosed()
+    )
+    print(f"抽出結果: {result}\n")
+
+    # 2文に達した時点で停止
+    summary = streaming_chat_with_stop(
+        "機械学習とは何か説明してください。",
+        SentenceCount(2)
+    )
+    print(f"要約: {summary}\n")
+
+    print(f"統計: {stats.summary()}")
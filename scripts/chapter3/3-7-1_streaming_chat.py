@@ -39,7 +39,8 @@ def streaming_chat(prompt: str) -> str:
     print(f"\n質問: {prompt}")
     print("回答: ", end="", flush=True)
 
-    accumulated_text = ""
+    # 文字列の連結を繰り返すとコピーが増えるため、リストに溜めて最後に結合する
+    parts = []
     start_time = time.time()
 
     try:
@@ -57,7 +58,7 @@ def streaming_chat(prompt: str) -> str:
         for chunk in stream:
             if chunk.choices[0].delta.content is not None:
                 content = chunk.choices[0].delta.content
-                accumulated_text += content
+                parts.append(content)
                 print(content, end="", flush=True)
 
         end_time = time.time()
@@ -67,7 +68,7 @@ def streaming_chat(prompt: str) -> str:
         print(f"\nエラー: {e}")
         return "APIエラーが発生しました。APIキーを確認してください。"
 
-    return accumulated_text
+    return "".join(parts)
 
 def main():
     """メイン実行関数"""
@@ -0,0 +1,142 @@
+import itertools
+import os
+import string
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from openai import OpenAI
+
+load_dotenv()
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+class CompiledTemplate:
+    """一度だけ解析したテンプレート（リテラル部分と変数名のリストとして保持）"""
+
+    def __init__(self, name, template):
+        self.name = name
+        self.parts = []
+        self.variables = set()
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if literal:
+                self.parts.append((True, literal))
+            if field is not None:
+                # 書式指定や属性参照は扱わない（単純な{name}のみ）
+                if not field.isidentifier() or spec or conversion:
+                    raise ValueError(f"{name}: 未対応のプレースホルダです: {{{field}}}")
+                self.parts.append((False, field))
+                self.variables.add(field)
+
+    def render(self, values):
+        missing = self.variables - values.keys()
+        if missing:
+            raise KeyError(f"{self.name}: 変数が不足しています: {sorted(missing)}")
+        return "".join(text if is_literal else str(values[text]) for is_literal, text in self.parts)
+
+class TemplateRegistry:
+    """テンプレートを登録時にコンパイルし、レンダリング結果をキャッシュする"""
+
+    def __init__(self, cache_size=1024):
+        self.templates = {}
+        self.labels = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, name, template, labels=None):
+        """テンプレートを登録（labelsで入力値→表示名の変換表を指定できる）"""
+        compiled = CompiledTemplate(name, template)
+        labels = labels or {}
+        unknown = labels.keys() - compiled.variables
+        if unknown:
+            raise ValueError(f"{name}: テンプレートにない変数のラベルです: {sorted(unknown)}")
+        self.templates[name] = compiled
+        self.labels[name] = labels
+        return compiled
+
+    def render(self, name, **values):
+        """変数を埋め込んだプロンプトを返す（同じ変数の組み合わせはキャッシュから返す）"""
+        key = (name, tuple(sorted(values.items())))
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.misses += 1
+        compiled = self.templates[name]
+        unknown = values.keys() - compiled.variables
+        if unknown:
+            raise KeyError(f"{name}: 未定義の変数です: {sorted(unknown)}")
+        labels = self.labels[name]
+        resolved = {k: labels[k].get(v, v) if k in labels else v for k, v in values.items()}
+        prompt = compiled.render(resolved)
+
+        self.cache[key] = prompt
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return prompt
+
+    def render_many(self, name, grid, **fixed):
+        """gridの全組み合わせ（例: role × level × language）をレンダリング"""
+        keys = list(grid)
+        for combo in itertools.product(*(grid[k] for k in keys)):
+            values = {**fixed, **dict(zip(keys, combo))}
+            yield values, self.render(name, **values)
+
+def run_many(prompts, call, max_workers=8):
+    """render_manyの結果をスレッドプールで並列に実行し、(変数, 結果) を返す"""
+    prompts = list(prompts)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda item: call(item[1]), prompts)
+        return [(values, result) for (values, _), result in zip(prompts, results)]
+
+registry = TemplateRegistry()
+registry.register(
+    "explanation",
+    """
+あなたは教育の専門家です。
+
+次の内容を{language}で300文字以内で説明してください。
+対象者: {role}
+理解度レベル: {level}
+
+内容:
+{topic}
+
+説明の条件:
+- 営業向けなら、ビジネス的な価値や活用例を重視
+- エンジニア向けなら、技術的な詳細や仕組みを重視
+- 初心者には専門用語を避け、具体例を交える
+- 上級者には専門的な背景知識や用語も含める
+""",
+    labels={
+        "role": {"sales": "営業担当者", "engineer": "エンジニア"},
+        "level": {"beginner": "初心者", "advanced": "上級者"},
+        "language": {"ja": "日本語", "en": "English"},
+    }
+)
+
+def generate(prompt):
+    """プロンプトをモデルに投げて結果を返す"""
+    response = client.chat.completions.create(
+        model="gpt-5-nano",
+        messages=[{"role": "user", "content": prompt}],
+    )
+    return response.choices[0].message.content.strip()
+
+# 使用例
+if __name__ == "__main__":
+    # 対象者 × 理解度 × 言語 の全8パターンを一括生成して並列実行
+    grid = {
+        "role": ["sales", "engineer"],
+        "level": ["beginner", "advanced"],
+        "language": ["ja", "en"],
+    }
+    prompts = registry.render_many("explanation", grid, topic="機械学習の基礎")
+    for values, result in run_many(prompts, generate):
+        print(f"=== {values['role']} / {values['level']} / {values['language']} ===")
+        print(result)
+
+    # 同じ組み合わせはキャッシュから返る
+    registry.render("explanation", role="sales", level="beginner", language="ja", topic="機械学習の基礎")
+    print(f"\nキャッシュ ヒット: {registry.hits}回, ミス: {registry.misses}回")
@@ -1,5 +1,8 @@
 from openai import OpenAI
+import json
+import math
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -24,7 +27,113 @@ def controlled_chat(prompt, max_completion_tokens=100):
         print(f"エラー: {e}")
         return None
 
+class AdaptiveTokenLimit:
+    """過去の出力トークン数からテンプレートごとの上限を学習する
+
+    上限を高めの分位点に合わせることで、TPMの予約分を減らしつつ
+    途中で切れる回答を少なく抑えます。
+    """
+
+    def __init__(self, default_limit=1000, quantile=0.95, margin=1.2, min_samples=10,
+                 max_history=500, history_file="./tmp/completion_lengths.json"):
+        self.default_limit = default_limit
+        self.quantile = quantile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.max_history = max_history
+        self.history_file = Path(history_file)
+        self.history = {}
+        self.requests = 0
+        self.truncations = 0
+        self.reserved_saved = 0
+        self._load()
+
+    def _load(self):
+        """保存済みの履歴を読み込む"""
+        if self.history_file.exists():
+            try:
+                self.history = json.loads(self.history_file.read_text())
+            except (json.JSONDecodeError, OSError):
+                pass
+
+    def _save(self):
+        """履歴を保存"""
+        self.history_file.parent.mkdir(parents=True, exist_ok=True)
+        self.history_file.write_text(json.dumps(self.history))
+
+    def limit_for(self, template_id):
+        """テンプレートに対する max_completion_tokens を決める"""
+        lengths = self.history.get(template_id, [])
+        if len(lengths) < self.min_samples:
+            return self.default_limit
+        ordered = sorted(lengths)
+        index = min(math.ceil(self.quantile * len(ordered)) - 1, len(ordered) - 1)
+        return max(1, math.ceil(ordered[index] * self.margin))
+
+    def record(self, template_id, completion_tokens, limit, truncated, calls=1):
+        """実際の出力トークン数（続きの生成を含む合計）を記録
+
+        calls は続きの生成を含むAPI呼び出しの回数（呼び出しごとに limit を予約する）
+        """
+        lengths = self.history.setdefault(template_id, [])
+        lengths.append(completion_tokens)
+        del lengths[:-self.max_history]
+        self.requests += 1
+        self.truncations += truncated
+        # 固定上限なら1回の呼び出しで済んだ前提で比べる（続きの生成が多いとマイナスになる）
+        self.reserved_saved += self.default_limit - limit * calls
+        self._save()
+
+    def report(self):
+        """途中切れ率と、固定上限と比べて減らせた予約トークン数を返す"""
+        return {
+            "requests": self.requests,
+            "truncation_rate": self.truncations / self.requests if self.requests else 0.0,
+            "tpm_headroom_gained": self.reserved_saved,
+        }
+
+limiter = AdaptiveTokenLimit()
+
+def adaptive_chat(prompt, template_id, max_continuations=2):
+    """学習した上限でチャットし、上限で切れた場合は最初から作り直さずに続きを生成"""
+    limit = limiter.limit_for(template_id)
+    messages = [{"role": "user", "content": prompt}]
+    parts = []
+    total_tokens = 0
+    truncated = False
+
+    for _ in range(max_continuations + 1):
+        response = client.chat.completions.create(
+            model="gpt-4.1-nano",
+            messages=messages,
+            max_completion_tokens=limit,
+            temperature=0.7
+        )
+        choice = response.choices[0]
+        parts.append(choice.message.content or "")
+        total_tokens += response.usage.completion_tokens
+
+        if choice.finish_reason != "length":
+            break
+        # 途中までの回答を履歴に入れ、続きだけを書かせる
+        truncated = True
+        messages = messages + [
+            {"role": "assistant", "content": choice.message.content or ""},
+            {"role": "user", "content": "回答が途中で切れています。直前の文の続きから、重複せずにそのまま出力してください。"}
+        ]
+
+    limiter.record(template_id, total_tokens, limit, truncated, calls=len(parts))
+    print(f"上限: {limit}トークン | 出力: {total_tokens}トークン | 続きの生成: {len(parts) - 1}回")
+    return "".join(parts)
+
 # 使用例
-prompt = "Pythonプログラミングについて、200文字以内で説明してください"
-result = controlled_chat(prompt, max_completion_tokens=300)
-print(f"回答: {result}")
+if __name__ == "__main__":
+    prompt = "Pythonプログラミングについて、200文字以内で説明してください"
+    result = controlled_chat(prompt, max_completion_tokens=300)
+    print(f"回答: {result}")
+
+    # 同じテンプレートの利用が増えるほど、上限が実際の出力長に合わせて調整される
+    for topic in ["Python", "JavaScript", "Go"]:
+        result = adaptive_chat(f"{topic}プログラミングについて、200文字以内で説明してください", "explain-200")
+        print(f"回答: {result}\n")
+    print(f"統計: {limiter.report()}")
@@ -1,39 +1,231 @@
 import re
+import time
 import tiktoken
 
-def optimize_input_text(text):
-    """入力テキストを最適化してトークン数を削減"""
-    # 余分な空白と改行を削除
-    text = re.sub(r'\s+', ' ', text)
+# 全角英数字・記号を半角へ変換するテーブル（日本語の句読点「，」「．」は対象外）
+_WIDTH_TABLE = {
+    code: code - 0xFEE0
+    for code in range(0xFF01, 0xFF5F)
+    if code not in (0xFF0C, 0xFF0E)
+}
+_WIDTH_TABLE[0x3000] = 0x20  # 全角スペース
+
+# 正規化ステージの実行順
+STAGES = ("width", "html", "boilerplate", "whitespace", "punctuation")
+
+class TextNormalizer:
+    """入力テキストを1パスで正規化するパイプライン
+
+    有効なステージを1つの正規表現（名前付きグループの選択）にまとめて
+    コンパイルしておき、re.subを1回だけ実行します。
+    """
+
+    def __init__(self, stages=("html", "boilerplate", "whitespace", "punctuation"),
+                 boilerplate=(), normalize_width=False):
+        self.stages = tuple(s for s in STAGES if s in stages or (s == "width" and normalize_width))
+        self.boilerplate = tuple(sorted(set(boilerplate), key=len, reverse=True))
+        self._hold = max((len(b) for b in self.boilerplate), default=1) - 1
+        self._boilerplate_re = (
+            re.compile("|".join(re.escape(b) for b in self.boilerplate))
+            if "boilerplate" in self.stages and self.boilerplate else None
+        )
+        self._pattern = self._compile()
+
+    def _compile(self):
+        """有効なステージから1つの正規表現を組み立てる"""
+        ws = "whitespace" in self.stages
+        tag = r"<[^<>]+>"
+        # 空白の圧縮が有効な場合は、タグや定型文の前後の空白もまとめて吸収する
+        around = r"\s*" if ws else ""
+
+        # HTMLタグと定型文は連続して現れることが多いため、同じグループでまとめて除去する
+        removable = []
+        if "html" in self.stages:
+            removable.append(tag)
+        if self._boilerplate_re is not None:
+            removable.append(self._boilerplate_re.pattern)
+
+        removable = "|".join(removable)
+        # 句読点の間にある（除去される）タグ・定型文と空白は読み飛ばしてまとめる
+        gap = rf"(?:{removable}|\s)*" if removable else ""
+        self._gap_only = re.compile(gap) if gap and "punctuation" in self.stages else None
+        self._removable_only = re.compile(rf"(?:{removable})+") if removable else None
+
+        parts = []
+        if removable:
+            parts.append(rf"(?P<remove>{around}(?:(?:{removable}){around})+)")
+        if ws:
+            parts.append(r"(?P<whitespace>\s+)")
+        if "punctuation" in self.stages:
+            parts.append(rf"(?P<kuten>[。．](?:{gap}[。．])+)")
+            parts.append(rf"(?P<touten>[、，](?:{gap}[、，])+)")
+        return re.compile("|".join(parts)) if parts else None
+
+    def _replace(self, match):
+        """マッチしたステージに応じた置換文字列を返す"""
+        kind = match.lastgroup
+        if kind == "kuten":
+            return "。"
+        if kind == "touten":
+            return "、"
+        if kind == "whitespace":
+            return " "
+        # HTMLタグ・定型文は除去し、間に空白を挟んでいれば1つだけ残す
+        if "whitespace" not in self.stages or self._removable_only.fullmatch(match.group()):
+            return ""
+        return " "
+
+    def _apply(self, text):
+        """前後の空白を残したまま正規化する"""
+        if "width" in self.stages:
+            text = text.translate(_WIDTH_TABLE)
+        if self._pattern is not None:
+            text = self._pattern.sub(self._replace, text)
+        return text
 
-    # HTMLタグを除去
-    text = re.sub(r'<[^>]+>', '', text)
+    def normalize(self, text):
+        """テキストを正規化する"""
+        return self._apply(text).strip()
 
-    # 重複する句読点を統一
-    text = re.sub(r'[。．]{2,}', '。', text)
-    text = re.sub(r'[、，]{2,}', '、', text)
+    def _safe_cut(self, buf):
+        """チャンク境界をまたぐマッチを壊さない切り出し位置を求める"""
+        cut = len(buf) - self._hold
+        while cut > 0:
+            new_cut = cut
+            lt = buf.rfind("<", 0, cut)
+            c = buf[cut - 1]
+            if lt != -1 and buf.find(">", lt, cut) == -1:
+                # 閉じていないタグの手前まで戻る
+                new_cut = lt
+            elif c.isspace() or c in "。．、，":
+                # 末尾の空白・句読点は次のチャンクと連結してから処理する
+                new_cut = cut - 1
+            elif self._gap_only is not None and (
+                (p := max(buf.rfind(mark, 0, cut) for mark in "。．、，")) != -1
+                and self._gap_only.fullmatch(buf, p + 1, cut)
+            ):
+                # 句読点の後に除去される部分しかない場合は、次の句読点とまとめられるよう句読点から保留する
+                new_cut = p
+            elif c == ">" and lt != -1:
+                new_cut = lt
+            elif self._boilerplate_re is not None:
+                # 切り出し位置をまたぐ定型文の手前まで戻る
+                for m in self._boilerplate_re.finditer(buf, max(cut - self._hold, 0), cut + self._hold):
+                    if m.start() < cut < m.end():
+                        new_cut = m.start()
+                        break
+            if new_cut == cut:
+                break
+            cut = new_cut
+        return max(cut, 0)
 
-    # 前後の空白を削除
-    text = text.strip()
+    def normalize_stream(self, chunks, max_buffer=1 << 16):
+        """大きな入力をチャンク単位で正規化するジェネレーター"""
+        buf = ""
+        started = False
+        pending = ""  # 次の出力の直前に置く空白（末尾の空白は最後に削除するため保留）
+        collapse = "whitespace" in self.stages
 
-    return text
+        def emit(out):
+            nonlocal started, pending
+            if not started:
+                out = out.lstrip()
+            elif out and not (collapse and out[0].isspace()):
+                out = pending + out
+            body = out.rstrip()
+            if not body:
+                if started and out:
+                    pending = out
+                return ""
+            started = True
+            pending = out[len(body):]
+            return body
+
+        for chunk in chunks:
+            buf += chunk
+            cut = self._safe_cut(buf)
+            # 閉じられない"<"などで保留分が増え続ける場合はそのまま流す
+            if cut == 0 and len(buf) > max_buffer:
+                cut = len(buf)
+            if cut:
+                out = emit(self._apply(buf[:cut]))
+                buf = buf[cut:]
+                if out:
+                    yield out
+        out = emit(self._apply(buf))
+        if out:
+            yield out
+
+    def report(self, text, model="gpt-5-nano"):
+        """ステージごとの削減トークン数と処理時間（ミリ秒/MB）を計測"""
+        before = count_tokens(text, model)
+        stages = []
+        for i, stage in enumerate(self.stages):
+            partial = TextNormalizer(
+                stages=self.stages[:i + 1],
+                boilerplate=self.boilerplate,
+                normalize_width="width" in self.stages[:i + 1],
+            )
+            after = count_tokens(partial.normalize(text), model)
+            stages.append({"stage": stage, "tokens": after, "saved": before - after})
+            before = after
+
+        start = time.perf_counter()
+        self.normalize(text)
+        elapsed = time.perf_counter() - start
+        mb = max(len(text.encode("utf-8")) / 1_000_000, 1e-9)
+
+        return {
+            "original_tokens": count_tokens(text, model),
+            "optimized_tokens": before,
+            "stages": stages,
+            "ms_per_mb": elapsed * 1000 / mb,
+        }
+
+_default_normalizer = TextNormalizer()
+
+def optimize_input_text(text):
+    """入力テキストを最適化してトークン数を削減"""
+    return _default_normalizer.normalize(text)
 
 def count_tokens(text, model="gpt-5-nano"):
     """指定されたモデルでのトークン数をカウント"""
     encoding = tiktoken.encoding_for_model(model)
     return len(encoding.encode(text))
 
-# 使用例
-original_text = """
+if __name__ == "__main__":
+    # 使用例
+    original_text = """
     これは    サンプルテキストです。。。
 
 
     不要な空白や、、、重複する句読点があります。
-    <div>HTMLタグも含まれています</div>
+    <div
+      class="note">HTMLタグも含まれています</div>
+    ＡＰＩの利用料金は１００円です。
+    この記事をシェアする
 """
 
-optimized_text = optimize_input_text(original_text)
+    optimized_text = optimize_input_text(original_text)
+
+    print(f"元のテキスト: {count_tokens(original_text)}トークン")
+    print(f"最適化後: {count_tokens(optimized_text)}トークン")
+    print(f"削減率: {((count_tokens(original_text) - count_tokens(optimized_text)) / count_tokens(original_text) * 100):.1f}%")
+
+    # 定型文除去と全角・半角正規化を有効にしたパイプライン
+    normalizer = TextNormalizer(boilerplate=["この記事をシェアする"], normalize_width=True)
+    normalized = normalizer.normalize(original_text)
+    print(f"\n正規化結果: {normalized}")
+    print(f"もう一度正規化しても変わらない: {normalizer.normalize(normalized) == normalized}")
+
+    # ステージごとの削減量
+    report = normalizer.report(original_text)
+    print("\n=== ステージ別の削減トークン数 ===")
+    for stage in report["stages"]:
+        print(f"{stage['stage']:<12}: -{stage['saved']}トークン（残り {stage['tokens']}）")
+    print(f"処理速度: {report['ms_per_mb']:.1f}ms/MB")
 
-print(f"元のテキスト: {count_tokens(original_text)}トークン")
-print(f"最適化後: {count_tokens(optimized_text)}トークン")
-print(f"削減率: {((count_tokens(original_text) - count_tokens(optimized_text)) / count_tokens(original_text) * 100):.1f}%")
+    # ストリーミングモード（大きな入力をチャンクごとに処理）
+    chunks = [original_text[i:i + 16] for i in range(0, len(original_text), 16)]
+    streamed = "".join(normalizer.normalize_stream(chunks))
+    print(f"\nストリーミング結果が一括処理と一致: {streamed == normalizer.normalize(original_text)}")
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+from dotenv import load_dotenv
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, create_model
+
+load_dotenv()
+
+# Pydanticモデルを定義
+class Person(BaseModel):
+    name: str = Field(description="人物の名前")
+    age: int = Field(description="人物の年齢", ge=0, le=150)
+
+# モデル
+model = ChatOpenAI(
+    model="gpt-5-nano",
+    api_key=os.getenv('OPENAI_API_KEY')
+)
+
+def strict_schema(schema: dict) -> dict:
+    """Pydanticが生成したJSONスキーマを、Structured Outputsのstrictモードで使える形に整える"""
+    if isinstance(schema, list):
+        return [strict_schema(s) for s in schema]
+    if not isinstance(schema, dict):
+        return schema
+    original = schema
+    # title と default は不要（strictモードでは使えず、トークンも増える）
+    schema = {k: strict_schema(v) for k, v in schema.items() if k not in ("title", "default", "properties", "$defs")}
+    for key in ("properties", "$defs"):
+        if key in original:
+            # フィールド名が title などでも消さないよう、名前の辞書はそのまま残す
+            schema[key] = {name: strict_schema(sub) for name, sub in original[key].items()}
+    if schema.get("type") == "object":
+        schema["additionalProperties"] = False
+        schema["required"] = list(schema.get("properties", {}))
+    return schema
+
+class BulkExtractor:
+    """複数の入力をまとめて1回のリクエストで抽出する
+
+    - response_format の json_schema は Pydantic モデルから1回だけ生成する
+    - 入力は batch_size 件ずつ配列としてまとめ、各バッチを並列に実行する
+    - 結果は事前に作った（コンパイル済みの）検証器で1件ずつ検証する
+    """
+
+    def __init__(self, model, schema_model, instruction, batch_size=50, max_concurrency=4):
+        self.model = model
+        self.schema_model = schema_model
+        self.instruction = instruction
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+        # 入力の番号(id)を加えた1件分のモデルと、それを配列で返すモデル
+        item_model = create_model(
+            f"{schema_model.__name__}Item",
+            __base__=schema_model,
+            id=(int, Field(description="入力の番号")),
+        )
+        batch_model = create_model(f"{schema_model.__name__}Batch", results=(list[item_model], ...))
+        self.item_validator = TypeAdapter(item_model)
+        self.bound_model = model.bind(response_format={
+            "type": "json_schema",
+            "json_schema": {
+                "name": batch_model.__name__.lower(),
+                "strict": True,
+                "schema": strict_schema(batch_model.model_json_schema()),
+            }
+        })
+        self.input_tokens = 0
+        self.requests = 0
+
+    def _messages(self, batch):
+        records = "\n".join(json.dumps({"id": i, "text": text}, ensure_ascii=False) for i, text in batch)
+        return [SystemMessage(self.instruction), HumanMessage(records)]
+
+    async def _run_batch(self, batch):
+        """1バッチを実行し、検証に通った結果を {id: モデル} で返す
+
+        APIエラーや、出力が途中で切れてJSONとして読めない場合は空の結果を返す
+        （そのバッチの入力は extract() で1件ずつ再実行される）
+        """
+        try:
+            async with self.semaphore:
+                response = await self.bound_model.ainvoke(self._messages(batch))
+            self.requests += 1
+            if response.usage_metadata:
+                self.input_tokens += response.usage_metadata["input_tokens"]
+            raw_results = json.loads(response.content).get("results", [])
+        except Exception as e:
+            print(f"バッチの実行に失敗しました（{len(batch)}件）: {e}")
+            return {}
+
+        expected = {i for i, _ in batch}
+        results = {}
+        for raw in raw_results:
+            try:
+                item = self.item_validator.validate_python(raw)
+            except ValidationError as e:
+                print(f"検証エラー: {raw}: {e.errors()[0]['msg']}")
+                continue
+            if item.id in expected:
+                fields = item.model_dump(exclude={"id"})
+                results[item.id] = self.schema_model.model_construct(**fields)
+        return results
+
+    async def extract(self, texts):
+        """入力と同じ順番で結果を返す（抽出できなかったものは、1件ずつのバッチで1回だけ再実行）"""
+        records = list(enumerate(texts))
+        batches = [records[i:i + self.batch_size] for i in range(0, len(records), self.batch_size)]
+        results = {}
+        for found in await asyncio.gather(*(self._run_batch(b) for b in batches)):
+            results.update(found)
+
+        missing = [(i, text) for i, text in records if i not in results]
+        if missing:
+            for found in await asyncio.gather(*(self._run_batch([record]) for record in missing)):
+                results.update(found)
+        return [results.get(i) for i in range(len(texts))]
+
+extractor = BulkExtractor(model, Person, "各行のtextから人物の名前と年齢を抽出し、同じidを付けて返してください。")
+
+def single_call_input_tokens(text):
+    """1件ずつPydanticOutputParserのフォーマット指示付きで送る場合の入力トークン数（4-3-3の方式）"""
+    parser = PydanticOutputParser(pydantic_object=Person)
+    prompt = ChatPromptTemplate.from_template(
+        """次の文章から人物情報を抽出してください。
+{format_instructions}
+
+文章: {text}"""
+    ).partial(format_instructions=parser.get_format_instructions())
+    return model.get_num_tokens_from_messages(prompt.invoke({"text": text}).to_messages())
+
+if __name__ == "__main__":
+    families = ["佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤"]
+    givens = ["花子", "太郎", "美咲", "一郎", "さくら"]
+    texts = [
+        f"{families[i % 10]}{givens[i % 5]}は{20 + i % 50}歳で、社内のプロジェクトに参加しています。"
+        for i in range(200)
+    ]
+
+    people = asyncio.run(extractor.extract(texts))
+    for text, person in list(zip(texts, people))[:5]:
+        print(f"{text} → {person}")
+    print(f"抽出できた件数: {sum(p is not None for p in people)}/{len(texts)}")
+
+    bulk = extractor.input_tokens / len(texts)
+    single = sum(single_call_input_tokens(t) for t in texts[:10]) / 10
+    print(f"リクエスト数: {extractor.requests}回")
+    print(f"1件あたりの入力トークン: まとめて {bulk:.1f} / 1件ずつ（推定） {single:.1f}")
@@ -1,9 +1,13 @@
+import json
 import os
+import re
 from dotenv import load_dotenv
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import PydanticOutputParser
-from pydantic import BaseModel, Field
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
+from pydantic import BaseModel, Field, ValidationError
 
 load_dotenv()
 
@@ -28,9 +32,152 @@ model = ChatOpenAI(
     api_key=os.getenv('OPENAI_API_KEY')
 )
 
-# Chain: プロンプト → モデル → パーサー
-chain = prompt | model | parser
+LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+def _repair_from(text: str) -> str:
+    """text の先頭の括弧から始まるJSONを直す（途中で切れた値は直さずにエラーにする）"""
+    out = []
+    stack = []
+    quote = None  # 文字列の中なら、その開始の引用符
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == "\\" and i + 1 < len(text):
+                nxt = text[i + 1]
+                # シングルクォート内の \' はJSONでは不要なエスケープ
+                out.append(nxt if (quote == "'" and nxt == "'") else ch + nxt)
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')  # シングルクォート内のダブルクォート
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+        elif ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            # 閉じ括弧の直前のカンマを取り除く
+            while out and out[-1] in " \t\r\n,":
+                out.pop()
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                break  # ルートが閉じたら後ろの文章は無視
+        elif ch.isalpha():
+            word = re.match(r"\w+", text[i:]).group(0)
+            out.append(LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    repaired = "".join(out).rstrip()
+    if stack:
+        # 途中で切れた出力は、最後のトークンが完結している場合だけ閉じる
+        # （文字列・数値の途中や値のないキーで切れていると、本来の値がわからないため）
+        if quote or not re.search(r'([{}\[\],"]|\b(?:true|false|null))$', repaired):
+            raise json.JSONDecodeError("出力が途中で切れています", text, len(text))
+        repaired = repaired.rstrip(" \t\r\n,")
+    return repaired + "".join(reversed(stack))
+
+def repair_json(text: str) -> str:
+    """よくある崩れ（コードブロック・前後の文章・末尾のカンマ・シングルクォート・
+    Pythonのリテラル・閉じ括弧の欠け）を機械的に直したJSON文字列を返す
+
+    前の文章に含まれる括弧（例: "[注] 結果: {...}"）は読み飛ばし、直した結果がJSONとして
+    読める最初の { か [ から始める。値の途中で切れている場合は json.JSONDecodeError を送出する。
+    """
+    fence = re.search(r"```(?:json)?\s*(.*?)(?:```|$)", text, re.S)
+    # 閉じるフェンスだけの場合など、中身にJSONがなければ全体を使う
+    if fence and re.search(r"[{\[]", fence.group(1)):
+        text = fence.group(1)
+    starts = [m.start() for m in re.finditer(r"[{\[]", text)]
+    if not starts:
+        return text.strip()
+
+    error = None
+    for start in starts:
+        try:
+            repaired = _repair_from(text[start:])
+            json.loads(repaired)
+            return repaired
+        except json.JSONDecodeError as e:
+            error = error or e
+    raise error
+
+class RepairStats:
+    """パースの結果を集計（そのまま成功・ローカルで修復・再問い合わせ・失敗）"""
+
+    def __init__(self):
+        self.counts = {"ok": 0, "repaired": 0, "reasked": 0, "failed": 0}
+
+    def record(self, outcome):
+        self.counts[outcome] += 1
+
+    def report(self):
+        total = sum(self.counts.values())
+        rates = {f"{k}_rate": v / total if total else 0.0 for k, v in self.counts.items()}
+        return {"total": total, **self.counts, **rates}
+
+stats = RepairStats()
+
+def parse_or_repair(output: str) -> tuple[Person, bool]:
+    """そのままパースし、失敗したらローカルで修復してから検証する（戻り値の2つ目は修復したか）"""
+    try:
+        return parser.parse(output), False
+    except OutputParserException:
+        return Person.model_validate(json.loads(repair_json(output))), True
+
+# Chain: プロンプト → モデル → 文字列（パースは extract_person で行う）
+chain = prompt | model | StrOutputParser()
+
+def extract_person(text: str, max_reasks: int = 1) -> Person:
+    """人物情報を抽出（修復できない場合だけ、エラー内容を伝えてモデルに再度問い合わせる）"""
+    messages = prompt.invoke({"text": text}).to_messages()
+    output = chain.invoke({"text": text})
+    for attempt in range(max_reasks + 1):
+        try:
+            person, repaired = parse_or_repair(output)
+            stats.record("reasked" if attempt else "repaired" if repaired else "ok")
+            return person
+        except (json.JSONDecodeError, ValidationError) as e:
+            error = e
+        if attempt < max_reasks:
+            messages += [
+                AIMessage(output),
+                HumanMessage(f"上の出力は形式に合っていません（{error}）。指定の形式のJSONのみを出力してください。")
+            ]
+            output = model.invoke(messages).content
+    stats.record("failed")
+    raise OutputParserException(f"人物情報を抽出できませんでした: {error}", llm_output=output)
 
 # 実行
-result = chain.invoke({"text": "佐藤花子は30歳です。"})
-print(f"名前: {result.name}, 年齢: {result.age}")
+if __name__ == "__main__":
+    result = extract_person("佐藤花子は30歳です。")
+    print(f"名前: {result.name}, 年齢: {result.age}")
+
+    # よくある崩れ方の例（いずれもモデルに再度問い合わせずに修復できる）
+    for broken in [
+        '```json\n{"name": "山田太郎", "age": 25,}\n```',
+        "{'name': '鈴木一郎', 'age': 40}",
+        '[注] 抽出結果は次のとおりです: {"name": "田中美咲", "age": 28}。以上です。',
+    ]:
+        person, repaired = parse_or_repair(broken)
+        print(f"{person}（修復: {repaired}）")
+
+    # 値の途中で切れた出力は推測で閉じず、再問い合わせの対象にする
+    try:
+        parse_or_repair('{"name": "高橋健", "age": 3')
+    except json.JSONDecodeError as e:
+        print(f"修復しない: {e}")
+    print(f"統計: {stats.report()}")
@@ -0,0 +1,213 @@
+import json
+import os
+import time
+from typing import Annotated
+from dotenv import load_dotenv
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.utils.json import parse_partial_json
+from langchain_core.runnables import RunnableGenerator
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+load_dotenv()
+
+class IncrementalJsonParser:
+    """ストリーミングで届くJSONを1文字ずつ1回だけ読み、値が確定するたびに知らせるパーサー
+
+    受け取った部分をその都度パースし直さないため、全体の処理量は出力の長さに比例します。
+    root は読み進めながら更新される途中のdict（またはlist）です。
+    """
+
+    def __init__(self):
+        self.root = None
+        self.stack = []  # [コンテナ, パス, 次に入るキー]
+        self.started = False
+        self.done = False
+        self.in_string = False
+        self.in_literal = False
+        self.escape = False
+        self.buffer = []  # 読み途中の文字列・数値・true/false/null
+
+    def feed(self, chunk: str) -> list[tuple[tuple, object]]:
+        """チャンクを読み、確定した値を (パス, 値) のリストで返す"""
+        events = []
+        for ch in chunk:
+            if self.done:
+                break
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    # エスケープの解釈はjsonモジュールに任せる（文字列ごとに1回だけ）
+                    self._value(json.loads('"' + "".join(self.buffer) + '"'), events, is_string=True)
+                    continue
+                self.buffer.append(ch)
+                continue
+            if self.in_literal:
+                if ch not in ",}] \t\r\n":
+                    self.buffer.append(ch)
+                    continue
+                self.in_literal = False
+                self._value(json.loads("".join(self.buffer)), events)
+            if not self.started:
+                # ```json などの前置きは読み飛ばす
+                if ch not in "{[":
+                    continue
+                self.started = True
+
+            if ch == "{":
+                self._open({}, events)
+            elif ch == "[":
+                self._open([], events)
+            elif ch in "}]":
+                self._close(events)
+            elif ch == '"':
+                self.in_string = True
+                self.buffer = []
+            elif ch not in ",: \t\r\n":
+                self.in_literal = True
+                self.buffer = [ch]
+        return events
+
+    def _place(self, value):
+        """親のコンテナに値を入れ、そのパスを返す"""
+        if not self.stack:
+            self.root = value
+            return ()
+        frame = self.stack[-1]
+        container, path = frame[0], frame[1]
+        if isinstance(container, dict):
+            key = frame[2]
+            container[key] = value
+            frame[2] = None
+            return path + (key,)
+        container.append(value)
+        return path + (len(container) - 1,)
+
+    def _value(self, value, events, is_string=False):
+        if self.stack:
+            frame = self.stack[-1]
+            if isinstance(frame[0], dict) and frame[2] is None and is_string:
+                frame[2] = value  # キー
+                return
+        events.append((self._place(value), value))
+
+    def _open(self, container, events):
+        path = self._place(container)
+        self.stack.append([container, path, None])
+
+    def _close(self, events):
+        if not self.stack:
+            return
+        container, path, _ = self.stack.pop()
+        events.append((path, container))
+        if not self.stack:
+            self.done = True
+
+def parse_json_stream(chunks):
+    """文字列のストリームを受け取り、値が確定するたびに (パス, 値) を返す（RunnableGenerator用）
+
+    途中のdict（parser.root）は読み進めるたびに書き換わるため返さない。
+    確定した値はその後変わらないので、受け取った側で保持・比較してもよい。
+    """
+    parser = IncrementalJsonParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+async def aparse_json_stream(chunks):
+    """parse_json_stream の非同期版"""
+    parser = IncrementalJsonParser()
+    async for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
+
+class FieldValidator:
+    """Pydanticモデルの各フィールドを、値が確定した時点で個別に検証する"""
+
+    def __init__(self, model):
+        # フィールドごとの検証器は最初に1回だけ作る
+        self.adapters = {
+            name: TypeAdapter(Annotated[field.annotation, field])
+            for name, field in model.model_fields.items()
+        }
+
+    def validate(self, path, value):
+        """トップレベルのフィールドなら検証して (名前, 値) を返す（それ以外はNone）"""
+        if len(path) != 1 or path[0] not in self.adapters:
+            return None
+        return path[0], self.adapters[path[0]].validate_python(value)
+
+class Profile(BaseModel):
+    name: str = Field(description="人物の名前")
+    age: int = Field(description="人物の年齢", ge=0, le=150)
+    occupation: str = Field(description="職業")
+    hobbies: list[str] = Field(description="趣味の一覧")
+    summary: str = Field(description="人物の紹介文（100文字程度）")
+
+prompt = ChatPromptTemplate.from_template(
+"""
+次の文章から人物の情報を抽出し、JSONのみを出力してください。
+出力形式: {{"name": "...", "age": ..., "occupation": "...", "hobbies": ["..."], "summary": "..."}}
+
+文章: {text}
+"""
+)
+
+model = ChatOpenAI(
+    model="gpt-5-nano",
+    api_key=os.getenv('OPENAI_API_KEY')
+)
+
+# Chain: プロンプト → モデル → 文字列 → 確定した (パス, 値)
+chain = prompt | model | StrOutputParser() | RunnableGenerator(parse_json_stream, aparse_json_stream)
+
+def benchmark(n=2000, chunk_size=4):
+    """受け取るたびに全体をパースし直す方式と、処理時間を比較"""
+    data = {"items": [{"id": i, "name": f"項目{i}", "tags": ["a", "b"]} for i in range(n)]}
+    text = json.dumps(data, ensure_ascii=False)
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+    start = time.perf_counter()
+    parser = IncrementalJsonParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    incremental = time.perf_counter() - start
+    assert parser.root == data
+
+    # 先頭から再パースする方式は遅いため、最初の1/10だけ計測して全体を推定
+    start = time.perf_counter()
+    received = ""
+    for chunk in chunks[:len(chunks) // 10]:
+        received += chunk
+        parse_partial_json(received)
+    reparse = (time.perf_counter() - start) * 10
+
+    print(f"{len(text):,}文字・{len(chunks):,}チャンク: 逐次パース {incremental * 1000:.1f}ms, "
+          f"毎回再パース（推定） {reparse * 1000:.0f}ms 以上")
+
+if __name__ == "__main__":
+    validator = FieldValidator(Profile)
+    parser = IncrementalJsonParser()
+    text = "山田太郎は25歳のソフトウェアエンジニアです。週末はキャンプと写真撮影を楽しんでいます。"
+
+    # フィールドが確定するたびに、検証済みの値を表示する
+    start = time.perf_counter()
+    for chunk in (prompt | model | StrOutputParser()).stream({"text": text}):
+        for path, value in parser.feed(chunk):
+            try:
+                field = validator.validate(path, value)
+            except ValidationError as e:
+                print(f"検証エラー: {path}: {e.errors()[0]['msg']}")
+                continue
+            if field is not None:
+                print(f"[{time.perf_counter() - start:.2f}秒] {field[0]}: {field[1]}")
+
+    # チェーンとして使う場合は、確定した (パス, 値) が順に返る
+    for path, value in chain.stream({"text": text}):
+        print(f"{path}: {value}")
+
+    benchmark()
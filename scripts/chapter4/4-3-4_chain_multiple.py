@@ -1,7 +1,13 @@
+import asyncio
+import hashlib
+import json
 import os
 from dotenv import load_dotenv
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.prompts import BasePromptTemplate, ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable
+from langchain_core.stores import InMemoryStore
 from langchain_openai import ChatOpenAI
 
 load_dotenv()
@@ -12,12 +18,65 @@ model = ChatOpenAI(
 )
 to_str = StrOutputParser()
 
+def chain_fingerprint(runnable) -> str:
+    """プロンプトとモデルの設定から、チェーンを識別する値を作る（設定が変われば別の値になる）"""
+    parts = []
+    for step in getattr(runnable, "steps", [runnable]):
+        if isinstance(step, BasePromptTemplate):
+            parts.append(step.pretty_repr())
+        elif isinstance(step, BaseLanguageModel):
+            parts.append(json.dumps(step._identifying_params, sort_keys=True, default=str))
+        else:
+            parts.append(type(step).__name__)
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+class MemoizedRunnable(Runnable):
+    """同じ入力に対する結果を保存し、2回目以降は実行せずに返すラッパー
+
+    キーは「入力のハッシュ＋チェーンの指紋」です。保存先は InMemoryStore のほか、
+    mget/mset を持つ LangChain の BaseStore であれば差し替えられます。
+    """
+
+    def __init__(self, runnable, store=None):
+        self.runnable = runnable
+        self.store = store if store is not None else InMemoryStore()
+        self.fingerprint = chain_fingerprint(runnable)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, input) -> str:
+        payload = json.dumps(input, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(f"{self.fingerprint}:{payload}".encode()).hexdigest()
+
+    def invoke(self, input, config=None, **kwargs):
+        key = self._key(input)
+        cached = self.store.mget([key])[0]
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        result = self.runnable.invoke(input, config, **kwargs)
+        self.store.mset([(key, result)])
+        return result
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        key = self._key(input)
+        cached = (await self.store.amget([key]))[0]
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        result = await self.runnable.ainvoke(input, config, **kwargs)
+        await self.store.amset([(key, result)])
+        return result
+
 # 要約チェーン
 summary_prompt = ChatPromptTemplate.from_messages([
     ("system", "あなたは要約の専門家です。"),
     ("user",   "次の文章を一文で要約してください：\n{text}")
 ])
-summary_chain = summary_prompt | model | to_str
+# 同じ文章の要約は1回だけ実行する（合成チェーンの中でも結果を再利用）
+summary_chain = MemoizedRunnable(summary_prompt | model | to_str)
 
 
 # 翻訳チェーン（要約結果を受け取る）
@@ -32,14 +91,39 @@ translate_chain = translate_prompt | model | to_str
 # データの流れ：{"text": "..."} → summary_chain実行 → {"summary": 要約} → translate_chain実行
 composed_chain = {"summary": summary_chain} | translate_chain
 
-text = """今日は来年度主力商品の新プロジェクト打ち合わせがありました。
+def translate_corpus(texts, max_concurrency=8):
+    """複数の文章をまとめて要約→翻訳（同じ文章は1回だけ処理し、最大max_concurrency件を並列実行）"""
+    unique = list(dict.fromkeys(texts))
+    results = composed_chain.batch([{"text": t} for t in unique], config={"max_concurrency": max_concurrency})
+    translated = dict(zip(unique, results))
+    return [translated[t] for t in texts]
+
+async def atranslate_corpus(texts, max_concurrency=8):
+    """translate_corpus の非同期版"""
+    unique = list(dict.fromkeys(texts))
+    results = await composed_chain.abatch([{"text": t} for t in unique], config={"max_concurrency": max_concurrency})
+    translated = dict(zip(unique, results))
+    return [translated[t] for t in texts]
+
+if __name__ == "__main__":
+    text = """今日は来年度主力商品の新プロジェクト打ち合わせがありました。
 開発期間6ヶ月でチーム全員参加し詳細計画を策定しました。
 マーケティング部から顧客ニーズ、技術部から実装可能性の報告あり、
 来週までに作業項目整理し次回進捗確認予定。"""
 
-# 要約の結果を確認
-summary_result = summary_chain.invoke({"text": text})
-print("要約結果:", summary_result)
+    # 要約の結果を確認
+    summary_result = summary_chain.invoke({"text": text})
+    print("要約結果:", summary_result)
+
+    # 全体の結果（要約→翻訳）も確認（要約は保存済みの結果を使うため、LLM呼び出しは翻訳の1回のみ）
+    print("翻訳結果:", composed_chain.invoke({"text": text}))
+    print(f"要約キャッシュ ヒット: {summary_chain.hits}回, ミス: {summary_chain.misses}回")
 
-# 全体の結果（要約→翻訳）も確認
-print("翻訳結果:", composed_chain.invoke({"text": text}))
+    # 複数の文章をまとめて処理
+    corpus = [
+        text,
+        "社内勉強会で生成AIの活用事例を共有しました。参加者は30名で、次回はハンズオン形式で行う予定です。",
+        "新しい経費精算システムが来月から導入されます。領収書はスマートフォンで撮影して提出できます。",
+    ]
+    for original, translated in zip(corpus, asyncio.run(atranslate_corpus(corpus))):
+        print(f"\n{original[:20]}... → {translated}")
@@ -0,0 +1,152 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+from langchain_core.messages import SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+# トークン予算付きの会話履歴（4-4-2と共通）
+from token_budget_history import TokenBudgetChatMessageHistory, message_token_counter
+
+# 環境変数を読み込み
+load_dotenv()
+
+# LLMモデルを初期化
+llm = ChatOpenAI(
+    model="gpt-5-nano",
+    api_key=os.getenv('OPENAI_API_KEY')
+)
+
+# メッセージのトークン数を数える関数
+count_message_tokens = message_token_counter(llm)
+
+class SummarizingChatMessageHistory(TokenBudgetChatMessageHistory):
+    """予算から外れたメッセージを、バックグラウンドで要約に畳み込む会話履歴
+
+    要約は応答を返した後に別スレッドで更新されるため、ユーザーへの応答は遅くなりません。
+    次のターンでは、その時点で完了している最新の要約がシステムメッセージとして渡されます。
+    要約のトークン数も予算に含めるため、要約が伸びた分だけ古いメッセージを外します。
+    """
+
+    def __init__(self, summary_chain, max_tokens=1000, token_counter=count_message_tokens):
+        self.summary_chain = summary_chain
+        self._lock = threading.Lock()
+        self._history_lock = threading.RLock()  # 要約の更新スレッドとメッセージの追加が同時にウィンドウを変えないように
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._future = None
+        self._running = False
+        super().__init__(token_counter, max_tokens, on_evict=self._on_evict)
+
+    @property
+    def messages(self):
+        with self._history_lock:
+            summary = [self._summary_message()] if self.summary else []
+            return self.pinned + summary + self.window[self.start:]
+
+    @property
+    def total_tokens(self):
+        return super().total_tokens + self.summary_tokens
+
+    def _summary_message(self):
+        return SystemMessage(f"これまでの会話の要約: {self.summary}")
+
+    def _budget(self):
+        return super()._budget() - self.summary_tokens
+
+    def add_message(self, message, pinned=False):
+        with self._history_lock:
+            super().add_message(message, pinned)
+
+    def _on_evict(self, message):
+        with self._lock:
+            self.evicted.append(message)
+            if not self._running:
+                self._running = True
+                self._future = self._executor.submit(self._fold)
+
+    def _fold(self):
+        """外されたメッセージがなくなるまで要約を更新（1スレッドで順番に処理）"""
+        while True:
+            with self._lock:
+                batch, self.evicted = self.evicted, []
+                if not batch:
+                    self._running = False
+                    return
+            conversation = "\n".join(f"{m.type}: {m.content}" for m in batch)
+            try:
+                summary = self.summary_chain.invoke(
+                    {"summary": self.summary or "（なし）", "conversation": conversation}
+                )
+            except Exception as e:
+                print(f"要約の更新に失敗しました: {e}")
+                continue
+            with self._history_lock:
+                self.summary = summary
+                self.summary_tokens = self.token_counter(self._summary_message())
+                # 要約が伸びた分は古いメッセージを外す（外したものは次の周回で要約に畳み込む）
+                self._trim()
+
+    def wait(self):
+        """実行中の要約処理の完了を待つ"""
+        if self._future is not None:
+            self._future.result()
+
+    def clear(self):
+        super().clear()
+        self.summary = ""
+        self.summary_tokens = 0
+        self.evicted = []
+
+# プロンプトテンプレートを作成
+prompt = ChatPromptTemplate.from_messages([
+    ("system", "あなたは親切なアシスタントです。回答は200文字以内でしてください。"),
+    MessagesPlaceholder(variable_name="history"),
+    ("human", "{input}")
+])
+
+# チェーンを作成
+chain = prompt | llm
+
+# 外れた会話を要約するチェーン
+summary_prompt = ChatPromptTemplate.from_messages([
+    ("system", "あなたは会話の要約担当です。ユーザーの名前・職業・趣味などの事実は必ず残し、200文字以内で要約してください。"),
+    ("human", "これまでの要約:\n{summary}\n\n追加する会話:\n{conversation}\n\n更新した要約:")
+])
+summary_chain = summary_prompt | llm | StrOutputParser()
+
+# トークン予算付きのメッセージ履歴（デモのため予算を小さくしている）
+message_history = SummarizingChatMessageHistory(summary_chain, max_tokens=400)
+
+def get_session_history(session_id: str) -> SummarizingChatMessageHistory:
+    return message_history
+
+# RunnableWithMessageHistoryでメモリ機能を追加
+chain_with_history = RunnableWithMessageHistory(
+    chain,
+    get_session_history,
+    input_messages_key="input",
+    history_messages_key="history",
+)
+
+if __name__ == "__main__":
+    config = {"configurable": {"session_id": "abc123"}}
+
+    inputs = [
+        "こんにちは！私は田中といいます。普段はエンジニアとして働いています。趣味はキャンプです。",
+        "週末の過ごし方のアドバイスをください。",
+        "おすすめの本を教えてください。",
+        "私の名前と趣味を覚えていますか？",
+    ]
+
+    for i, input_text in enumerate(inputs, 1):
+        print(f"\n【{i}回目の会話】")
+        response = chain_with_history.invoke({"input": input_text}, config=config)
+        print("ユーザー: " + input_text)
+        print(f"アシスタント: {response.content}")
+        print(f"（履歴: {len(message_history.messages)}件, {message_history.total_tokens}トークン）")
+
+    message_history.wait()
+    print(f"\n【会話の要約】\n{message_history.summary}")
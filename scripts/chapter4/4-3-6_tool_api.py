@@ -1,76 +1,185 @@
 import os
 import json
+import time
+import asyncio
+import inspect
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import openai
 from dotenv import load_dotenv
 
 load_dotenv()
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+class ToolRegistry:
+    """ツールを登録し、APIに渡すJSONスキーマを登録時に1回だけ作って保持する
+
+    同期ツールは専用のスレッドプールで実行する（asyncio.run() の終了時に待たされないように）。
+    タイムアウトしたツールのスレッドは止められず、処理が終わるまで動き続ける
+    （その間はプールのスレッドを1つ占有し、プロセスの終了時にも終わるまで待つ）。
+    """
+
+    def __init__(self, max_workers=8):
+        self.tools = {}
+        self.schemas = []
+        self.cache = {}  # 純粋なツールの結果（同じ引数なら同じ結果）
+        self.cache_hits = 0
+        self.max_workers = max_workers
+        self.executor = None  # 同期ツール用のスレッドプール（最初の呼び出しで作る）
+
+    def register(self, description, parameters, timeout=10.0, pure=False):
+        """デコレーターとして使う（pure=Trueのツールは結果をキャッシュする）"""
+        def decorator(func):
+            self.tools[func.__name__] = {
+                "func": func,
+                "is_async": inspect.iscoroutinefunction(func),
+                "timeout": timeout,
+                "pure": pure,
+            }
+            self.schemas.append({
+                "type": "function",
+                "function": {
+                    "name": func.__name__,
+                    "description": description,
+                    "parameters": {
+                        "type": "object",
+                        "properties": parameters,
+                        "required": list(parameters)
+                    }
+                }
+            })
+            return func
+        return decorator
+
+    async def call(self, name, arguments):
+        """ツールを1つ実行（同期ツールはスレッドで、非同期ツールはそのまま実行）"""
+        tool = self.tools.get(name)
+        if tool is None:
+            return f"エラー: 未登録のツールです: {name}"
+
+        if not isinstance(arguments, dict):
+            return f"エラー: 引数はオブジェクトで指定してください: {arguments!r}"
+
+        key = (name, json.dumps(arguments, sort_keys=True))
+        if tool["pure"] and key in self.cache:
+            self.cache_hits += 1
+            return self.cache[key]
+
+        try:
+            # 引数の名前が合わない場合のTypeErrorも、エラーの文字列としてモデルに返す
+            if tool["is_async"]:
+                job = tool["func"](**arguments)
+            else:
+                # タイムアウトしてもスレッド自体は止められないため、結果を待たずに次へ進む
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="tool")
+                job = asyncio.get_running_loop().run_in_executor(
+                    self.executor, functools.partial(tool["func"], **arguments)
+                )
+            result = str(await asyncio.wait_for(job, tool["timeout"]))
+        except asyncio.TimeoutError:
+            return f"エラー: {name}が{tool['timeout']}秒以内に終わりませんでした"
+        except Exception as e:
+            return f"エラー: {name}の実行に失敗しました: {e}"
+
+        if tool["pure"]:
+            self.cache[key] = result
+        return result
+
+    def shutdown(self):
+        """同期ツール用のスレッドプールを閉じる（実行中・タイムアウトしたツールの終了は待たない）"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+registry = ToolRegistry()
+
+@registry.register(
+    "二つの数値を掛け算します",
+    {
+        "a": {"type": "number", "description": "最初の数値"},
+        "b": {"type": "number", "description": "二番目の数値"}
+    },
+    pure=True
+)
 def multiply(a, b):
     """掛け算ツール"""
     return a * b
 
-def chat_with_tools(user_input):
-    # ツール定義
-    tools = [{
-        "type": "function",
-        "function": {
-            "name": "multiply",
-            "description": "二つの数値を掛け算します",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "a": {"type": "number", "description": "最初の数値"},
-                    "b": {"type": "number", "description": "二番目の数値"}
-                },
-                "required": ["a", "b"]
-            }
-        }
-    }]
+@registry.register(
+    "都市の現在の天気を調べます",
+    {"city": {"type": "string", "description": "都市名"}},
+    timeout=5.0
+)
+async def get_weather(city):
+    """天気ツール（外部APIの代わりに1秒待ってダミーの値を返す）"""
+    await asyncio.sleep(1)
+    return json.dumps({"city": city, "weather": "晴れ", "temperature": 20}, ensure_ascii=False)
+
+async def run_tool_calls(tool_calls):
+    """1ターン分のツール呼び出しをすべて同時に実行（所要時間は最も遅いツールの分だけ）"""
+    async def run(tool_call):
+        try:
+            arguments = json.loads(tool_call.function.arguments)
+        except json.JSONDecodeError as e:
+            return f"エラー: 引数がJSONではありません: {e}"
+        print(f"ツール実行: {tool_call.function.name}({arguments})")
+        return await registry.call(tool_call.function.name, arguments)
 
+    results = await asyncio.gather(*(run(tool_call) for tool_call in tool_calls))
+    return [
+        {"role": "tool", "tool_call_id": tool_call.id, "content": result}
+        for tool_call, result in zip(tool_calls, results)
+    ]
+
+async def achat_with_tools(user_input, max_rounds=5):
+    """モデルがツールを呼ばなくなるまで、ツールの実行と再呼び出しを繰り返す"""
+    client = openai.AsyncOpenAI(api_key=openai.api_key)
     messages = [
-        {"role": "system", "content": "掛け算ツールを使って計算してください。"},
+        {"role": "system", "content": "必要に応じてツールを使って回答してください。"},
         {"role": "user", "content": user_input}
     ]
 
-    # 最初のAPI呼び出し
-    response = openai.chat.completions.create(
-        model="gpt-5-nano",
-        messages=messages,
-        tools=tools,
-        tool_choice="auto"
-    )
+    for _ in range(max_rounds):
+        response = await client.chat.completions.create(
+            model="gpt-5-nano",
+            messages=messages,
+            tools=registry.schemas,
+            tool_choice="auto"
+        )
+        message = response.choices[0].message
 
-    message = response.choices[0].message
+        # ツール呼び出しがなければ最終回答
+        if not message.tool_calls:
+            return message.content
 
-    # ツール呼び出しがある場合
-    if message.tool_calls:
         messages.append({
             "role": "assistant",
             "content": message.content,
-            "tool_calls": message.tool_calls
+            "tool_calls": [tool_call.model_dump() for tool_call in message.tool_calls]
         })
+        start = time.perf_counter()
+        messages.extend(await run_tool_calls(message.tool_calls))
+        print(f"{len(message.tool_calls)}件のツールを実行: {time.perf_counter() - start:.2f}秒")
 
-        for tool_call in message.tool_calls:
-            arguments = json.loads(tool_call.function.arguments)
-            print(f"ツール実行: multiply({arguments['a']}, {arguments['b']})")
-
-            result = multiply(arguments["a"], arguments["b"])
-            print(f"実行結果: {result}")
-
-            messages.append({
-                "role": "tool",
-                "tool_call_id": tool_call.id,
-                "content": str(result)
-            })
+    # 上限に達したらツールなしで回答させる
+    final_response = await client.chat.completions.create(
+        model="gpt-5-nano",
+        messages=messages,
+        tools=registry.schemas,
+        tool_choice="none"
+    )
+    return final_response.choices[0].message.content
 
-        # 最終回答を取得
-        final_response = openai.chat.completions.create(
-            model="gpt-5-nano",
-            messages=messages
-        )
-        return final_response.choices[0].message.content
+def chat_with_tools(user_input, max_rounds=5):
+    try:
+        return asyncio.run(achat_with_tools(user_input, max_rounds))
+    finally:
+        registry.shutdown()
 
-    return message.content
+if __name__ == "__main__":
+    print(chat_with_tools("7に8を掛けてください"))
 
-print(chat_with_tools("7に8を掛けてください"))
+    # 3都市の天気は同時に調べるため、約1秒で終わる
+    print(chat_with_tools("東京・大阪・福岡の天気を教えてください。それと、7に8を掛けた結果も教えてください。"))
+    print(f"キャッシュ ヒット: {registry.cache_hits}回")
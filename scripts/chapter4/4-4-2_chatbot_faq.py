@@ -1,9 +1,25 @@
+import argparse
+import asyncio
+import atexit
+import heapq
+import json
+import math
 import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnablePassthrough
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import HumanMessage, AIMessage, messages_from_dict, messages_to_dict
+
+# トークン予算付きの会話履歴（4-3-5と共通）
+from token_budget_history import TokenBudgetChatMessageHistory, message_token_counter
 
 load_dotenv()
 
@@ -12,31 +28,371 @@ llm = ChatOpenAI(
     api_key=os.getenv('OPENAI_API_KEY'),
 )
 
+# メッセージのトークン数を数える関数
+count_message_tokens = message_token_counter(llm)
+
+class StoredChatMessageHistory(TokenBudgetChatMessageHistory):
+    """変更をSessionStoreへ通知し、保存・復元ができる会話履歴
+
+    追加（aadd_messagesではexecutorのスレッドで実行される）と、書き込みスレッドの dump() が
+    同時に走らないよう、履歴ごとのロックで排他する。
+    """
+
+    def __init__(self, session_id, max_tokens=2000, token_counter=count_message_tokens):
+        self.session_id = session_id
+        self.store = None  # 復元が終わってから設定（復元中の変更は通知しない）
+        self.lock = threading.RLock()
+        super().__init__(token_counter, max_tokens)
+
+    @property
+    def messages(self):
+        with self.lock:
+            return super().messages
+
+    def add_message(self, message, pinned=False):
+        with self.lock:
+            super().add_message(message, pinned)
+            if self.store is not None:
+                self.store.mark_dirty(self)
+
+    def add_messages(self, messages):
+        # 質問と回答の組を、途中の状態で保存しないようまとめて追加する
+        with self.lock:
+            super().add_messages(messages)
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+            if self.store is not None:
+                self.store.mark_dirty(self)
+
+    def dump(self):
+        """保存用の辞書（予算内のメッセージと数えたトークン数のみ）"""
+        with self.lock:
+            return {
+                "pinned": messages_to_dict(self.pinned),
+                "pinned_tokens": self.pinned_tokens,
+                "window": messages_to_dict(self.window[self.start:]),
+                "token_counts": self.token_counts[self.start:],
+            }
+
+    def load(self, data):
+        """dump()の内容から復元（トークン数は数え直さない）"""
+        with self.lock:
+            self.pinned = messages_from_dict(data["pinned"])
+            self.pinned_tokens = data["pinned_tokens"]
+            self.window = messages_from_dict(data["window"])
+            self.token_counts = data["token_counts"]
+            self.window_tokens = sum(self.token_counts)
+            self.start = 0
+
+class SessionStore:
+    """セッション履歴の2層ストア（メモリ上のLRU＋SQLiteへの遅延書き込み）
+
+    - メモリには最近使った max_sessions 件だけを保持し、溢れたものや
+      ttl_seconds 以上使われていないものはメモリから外す
+    - 変更されたセッションは flush_interval 秒ごとにまとめてSQLiteへ書き込む
+    - メモリにないセッションは、使われたときにSQLiteから復元する
+    - SQLiteはWALモードで開くため、複数のワーカープロセスから同じファイルを共有できる
+      （同じセッションは同じワーカーに振り分ける前提）
+    """
+
+    def __init__(self, db_path="./tmp/faq_sessions.sqlite3", max_sessions=1000, ttl_seconds=1800,
+                 flush_interval=1.0, max_tokens=2000, token_counter=count_message_tokens):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter
+        self.sessions = OrderedDict()  # session_id -> (履歴, 最終アクセス時刻)（古い順）
+        self.dirty = {}  # 未保存のセッション（メモリから外れても保存までここに残す）
+        self.flushing = {}  # 書き込み中のセッション
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()  # 書き込みを1つずつ行う（古い内容で上書きしないため）
+        self.hits = 0
+        self.rehydrations = 0
+        self.created = 0
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    def get(self, session_id):
+        """セッションの履歴を返す（メモリ→未保存分→SQLiteの順に探し、なければ新規作成）"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is not None:
+                self.hits += 1
+                history = entry[0]
+                self.sessions.move_to_end(session_id)
+            else:
+                history = (self.dirty.get(session_id) or self.flushing.get(session_id)
+                           or self._rehydrate(session_id))
+            self.sessions[session_id] = (history, now)
+            self._evict(now)
+            return history
+
+    def _rehydrate(self, session_id):
+        history = StoredChatMessageHistory(session_id, self.max_tokens, self.token_counter)
+        row = self.conn.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is not None:
+            history.load(json.loads(row[0]))
+            self.rehydrations += 1
+        else:
+            self.created += 1
+        history.store = self
+        return history
+
+    def mark_dirty(self, history):
+        with self.lock:
+            self.dirty[history.session_id] = history
+
+    def _evict(self, now):
+        """件数の上限を超えた分と、TTLを過ぎたセッションをメモリから外す（古い順に見るだけ）"""
+        while self.sessions:
+            session_id, (_, last_access) = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_sessions and now - last_access < self.ttl_seconds:
+                break
+            self.sessions.popitem(last=False)
+
+    def flush(self):
+        """未保存のセッションを1トランザクションでまとめて書き込む"""
+        with self.flush_lock:
+            with self.lock:
+                if not self.dirty:
+                    return 0
+                self.flushing, self.dirty = self.dirty, {}
+            # dump() は履歴のロックを取るため、ストアのロックを離してから呼ぶ
+            # （履歴→ストアの順にロックを取る add_message とデッドロックしないように）
+            try:
+                now = time.time()
+                rows = [(sid, json.dumps(h.dump(), ensure_ascii=False), now) for sid, h in self.flushing.items()]
+                with self.lock, self.conn:
+                    self.conn.executemany(
+                        "INSERT INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(session_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                        rows
+                    )
+            except Exception:
+                with self.lock:
+                    self.dirty = {**self.flushing, **self.dirty}  # 次回にもう一度書き込む
+                raise
+            finally:
+                with self.lock:
+                    self.flushing = {}
+            return len(rows)
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+                with self.lock:
+                    self._evict(time.monotonic())
+            except sqlite3.Error as e:
+                print(f"セッションの保存に失敗しました: {e}")
+
+    def purge(self, older_than_seconds):
+        """指定秒数以上更新のないセッションをSQLiteから削除"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (time.time() - older_than_seconds,)
+            )
+            return cursor.rowcount
+
+    def close(self):
+        """バックグラウンドの書き込みを止め、残りを保存して閉じる"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
+        self.conn.close()
+
+    def stats(self):
+        return {
+            "in_memory": len(self.sessions),
+            "dirty": len(self.dirty),
+            "hits": self.hits,
+            "rehydrations": self.rehydrations,
+            "created": self.created,
+        }
+
+def tokenize(text: str) -> list[str]:
+    """BM25用に文字バイグラムへ分割（日本語は単語の区切りがないため）"""
+    text = "".join(ch.lower() for ch in text if ch.isalnum())
+    if len(text) < 2:
+        return [text] if text else []
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
 class FAQManager:
-    def __init__(self):
+    """FAQを保持し、質問に関連するものだけをBM25で検索する
+
+    転置インデックスは add() のたびに追加分だけ更新するため、登録のコストは件数によらずほぼ一定です。
+    検索のコストは質問に含まれる語の転置リストの長さに比例します。「方法」「の申」のように
+    多くのFAQに出てくる語（出現率が common_ratio を超える語）は全件を走査せず、
+    より珍しい語で候補になったFAQの点数にだけ加算します（珍しい語が1つもなければ通常どおり走査）。
+    """
+
+    def __init__(self, k1=1.2, b=0.75, common_ratio=0.05, min_common_df=1000):
         self.faq_list = []
+        self.k1 = k1
+        self.b = b
+        self.common_ratio = common_ratio
+        self.min_common_df = min_common_df  # FAQが少ないうちは常に全件を走査する
+        self.postings = {}  # 語 -> {FAQ番号: 出現回数}
+        self.doc_lengths = []
+        self.total_length = 0
 
     def add(self, question: str, answer: str):
-        """FAQを追加"""
+        """FAQを追加（インデックスも更新）"""
+        doc_id = len(self.faq_list)
         self.faq_list.append({"question": question, "answer": answer})
+        # 質問と回答の境目をまたぐバイグラムを作らないよう、別々に分割する
+        terms = tokenize(question) + tokenize(answer)
+        for term in terms:
+            tfs = self.postings.setdefault(term, {})
+            tfs[doc_id] = tfs.get(doc_id, 0) + 1
+        self.doc_lengths.append(len(terms))
+        self.total_length += len(terms)
 
-    def format_for_prompt(self) -> str:
-        """プロンプト用にFAQをフォーマット"""
-        if not self.faq_list:
+    def search(self, query: str, k: int = 3) -> list[tuple[float, dict]]:
+        """質問に関連するFAQを上位k件返す（質問に含まれる語の転置リストだけを走査）"""
+        n = len(self.faq_list)
+        if n == 0:
+            return []
+        # 文書長による正規化 k1 * (1 - b + b * 文書長 / 平均長) は、点数を付けるFAQの分だけその場で計算する
+        # （追加のたびに全件分を作り直さない）
+        doc_lengths = self.doc_lengths
+        norm_base = self.k1 * (1 - self.b)
+        norm_scale = self.k1 * self.b / (self.total_length / n or 1)
+        common_df = max(self.min_common_df, self.common_ratio * n)
+        scores = {}
+        # 珍しい語（転置リストが短い語）から順に処理する
+        postings = [self.postings[t] for t in set(tokenize(query)) if t in self.postings]
+        for tfs in sorted(postings, key=len):
+            weight = math.log(1 + (n - len(tfs) + 0.5) / (len(tfs) + 0.5)) * (self.k1 + 1)
+            if scores and len(tfs) > common_df:
+                # 頻出語は、すでに候補になったFAQにだけ点数を加える
+                for doc_id in scores:
+                    tf = tfs.get(doc_id)
+                    if tf:
+                        scores[doc_id] += weight * tf / (tf + norm_base + norm_scale * doc_lengths[doc_id])
+                continue
+            for doc_id, tf in tfs.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf / (tf + norm_base + norm_scale * doc_lengths[doc_id])
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, self.faq_list[doc_id]) for doc_id, score in top]
+
+    def format_for_prompt(self, query: str | None = None, k: int = 3) -> str:
+        """プロンプト用にFAQをフォーマット（queryを指定すると関連する上位k件のみ）"""
+        if query is None:
+            items = self.faq_list
+        else:
+            items = [item for _, item in self.search(query, k)]
+        if not items:
             return ""
 
         faq_text = "\n\n以下は事前に登録されているFAQです:\n\n"
-        for i, item in enumerate(self.faq_list, 1):
+        for i, item in enumerate(items, 1):
             faq_text += f"Q{i}: {item['question']}\nA{i}: {item['answer']}\n\n"
         return faq_text
 
+def question_similarity(a: str, b: str) -> float:
+    """2つの質問の文字バイグラムのDice係数（0〜1、ほぼ同じ文なら1に近い）"""
+    x, y = Counter(tokenize(a)), Counter(tokenize(b))
+    total = sum(x.values()) + sum(y.values())
+    return 2 * sum((x & y).values()) / total if total else 0.0
+
+class FAQFastPath:
+    """登録済みの質問とほぼ同じ質問には、LLMを呼ばずにFAQの回答をそのまま返す
+
+    BM25で候補を絞り、質問文どうしの類似度がしきい値以上の場合だけ一致とみなします。
+    しきい値は calibrate() でラベル付きの質問から決められます。
+    """
+
+    def __init__(self, faq: FAQManager, threshold=0.8, candidates=5,
+                 answer_template="{answer}\n（FAQ「{question}」の回答です）"):
+        self.faq = faq
+        self.threshold = threshold
+        self.candidates = candidates
+        self.answer_template = answer_template
+        self.requests = 0
+        self.fast_hits = 0
+        self.under_10ms = 0
+
+    def best_match(self, query: str):
+        """最も近いFAQとその類似度を返す"""
+        best, best_score = None, 0.0
+        for _, item in self.faq.search(query, self.candidates):
+            score = question_similarity(query, item["question"])
+            if score > best_score:
+                best, best_score = item, score
+        return best, best_score
+
+    def match(self, query: str) -> str | None:
+        """しきい値以上で一致したFAQの回答（テンプレート適用済み）を返す"""
+        item, score = self.best_match(query)
+        if item is None or score < self.threshold:
+            return None
+        return self.answer_template.format(**item)
+
+    def calibrate(self, labeled, target_precision=0.98, margin=0.05):
+        """(質問, 正解のFAQの質問 または None) のリストから、適合率を満たす最小のしきい値を選ぶ
+
+        例にない言い回しで誤答しないよう、しきい値は誤答になる例の最高スコアより margin 以上高くする。
+        """
+        results = []
+        for query, expected in labeled:
+            item, score = self.best_match(query)
+            results.append((score, item is not None and item["question"] == expected))
+        results.sort(key=lambda r: r[0], reverse=True)
+        floor = max((score for score, ok in results if not ok), default=0.0) + margin
+
+        threshold, correct = None, 0
+        for accepted, (score, ok) in enumerate(results, 1):
+            if score < floor:
+                break
+            correct += ok
+            # 同じスコアが続く間はしきい値を決めない
+            if accepted < len(results) and results[accepted][0] == score:
+                continue
+            if correct / accepted >= target_precision:
+                threshold = score
+        self.threshold = threshold if threshold is not None else max(self.threshold, floor)
+        return self.threshold
+
+    def record(self, fast, elapsed):
+        self.requests += 1
+        self.fast_hits += fast
+        self.under_10ms += elapsed < 0.01
+
+    def report(self):
+        """FAQから直接返した割合と、10ms未満で返した割合"""
+        return {
+            "requests": self.requests,
+            "fast_path_rate": self.fast_hits / self.requests if self.requests else 0.0,
+            "under_10ms_rate": self.under_10ms / self.requests if self.requests else 0.0,
+            "threshold": self.threshold,
+        }
+
 # FAQを登録
 faq = FAQManager()
 faq.add("有給休暇の申請方法", "勤怠管理システムから申請してください。直属の上司の承認が必要です。3日以上の連続休暇は1ヶ月前までに申請をお願いします。残日数は人事ポータルで確認できます。")
 faq.add("交通費の精算方法", "経費精算システムから精算を行ってください。領収書（ICカードの履歴でも可）をアップロードし、訪問先・目的を記入してください。月末締めで翌月給与と一緒に振り込まれます。")
 
-# プロンプト（役割＋FAQ＋履歴＋ユーザー入力）
-system_message = f"あなたは社内サポート用チャットボットです。400字以内で丁寧かつ正確に回答してください。{faq.format_for_prompt()}ユーザーの質問がFAQに該当する場合は、FAQの情報を基に回答してください。"
+# プロンプト（役割＋関連FAQ＋履歴＋ユーザー入力）
+system_message = "あなたは社内サポート用チャットボットです。400字以内で丁寧かつ正確に回答してください。{faq_context}ユーザーの質問がFAQに該当する場合は、FAQの情報を基に回答してください。"
 
 prompt = ChatPromptTemplate.from_messages([
     ("system", system_message),
@@ -44,16 +400,17 @@ prompt = ChatPromptTemplate.from_messages([
     ("human", "{input}")
 ])
 
-# チェーン（プロンプト→LLM）
-chain = prompt | llm
+# チェーン（関連FAQの検索→プロンプト→LLM）
+# FAQ全件ではなく、質問ごとに関連する上位3件だけをプロンプトに入れる
+chain = RunnablePassthrough.assign(faq_context=lambda x: faq.format_for_prompt(x["input"], k=3)) | prompt | llm
 
-# メッセージ履歴（セッションごとに管理）
-store: dict[str, InMemoryChatMessageHistory] = {}
+# メッセージ履歴（セッションごとに管理し、直近2000トークン分だけをモデルに渡す）
+# 最近のセッションはメモリに、それ以外はSQLiteに保存するため、再起動しても会話を続けられる
+store = SessionStore(max_tokens=2000)
+atexit.register(store.close)
 
-def get_session_history(session_id: str) -> InMemoryChatMessageHistory:
-    if session_id not in store:
-        store[session_id] = InMemoryChatMessageHistory()
-    return store[session_id]
+def get_session_history(session_id: str) -> StoredChatMessageHistory:
+    return store.get(session_id)
 
 # 会話用ラッパー
 chatbot = RunnableWithMessageHistory(
@@ -63,6 +420,37 @@ chatbot = RunnableWithMessageHistory(
     history_messages_key="chat_history"
 )
 
+# FAQとほぼ同じ質問はLLMを呼ばずに回答
+# しきい値は、FAQに該当する質問・該当しない質問の例から、誤答になる例より十分高い範囲で最も低い値に合わせる
+fast_path = FAQFastPath(faq)
+fast_path.calibrate([
+    ("有給休暇の申請方法", "有給休暇の申請方法"),
+    ("有給休暇の申請方法は？", "有給休暇の申請方法"),
+    ("有給休暇の申請方法を教えてください", "有給休暇の申請方法"),
+    ("交通費の精算", "交通費の精算方法"),
+    ("交通費の精算方法について", "交通費の精算方法"),
+    ("経費の精算方法", None),
+    ("出張の申請方法", None),
+    ("有給休暇の残日数", None),
+    ("有給休暇を取り消したい", None),
+])
+
+def respond(user_input: str, session_id: str) -> str:
+    """FAQに一致すればその回答を、しなければチャットボットの回答を返す（どちらも履歴に残す）"""
+    start = time.perf_counter()
+    answer = fast_path.match(user_input)
+    if answer is not None:
+        get_session_history(session_id).add_messages([HumanMessage(user_input), AIMessage(answer)])
+        fast_path.record(True, time.perf_counter() - start)
+        return answer
+
+    result = chatbot.invoke(
+        {"input": user_input},
+        config={"configurable": {"session_id": session_id}}
+    )
+    fast_path.record(False, time.perf_counter() - start)
+    return result.content
+
 # 対話モード
 def chat_mode():
     print("=== 社内サポートチャットボット (FAQ対応) ===")
@@ -78,20 +466,18 @@ def chat_mode():
             # 終了条件
             if user_input.lower() in ['quit', 'exit', 'q', '終了']:
                 print("チャットを終了します。")
+                print(f"統計: {fast_path.report()}")
                 break
 
             # 空入力をスキップ
             if not user_input:
                 continue
 
-            # チャットボットに送信
-            result = chatbot.invoke(
-                {"input": user_input},
-                config={"configurable": {"session_id": session_id}}
-            )
+            # チャットボットに送信（FAQと一致すればLLMを呼ばない）
+            answer = respond(user_input, session_id)
 
             # 回答を表示
-            print(f"ボット: {result.content}\n")
+            print(f"ボット: {answer}\n")
 
         except KeyboardInterrupt:
             print("\n\nチャットを終了します。")
@@ -99,5 +485,273 @@ def chat_mode():
         except Exception as e:
             print(f"エラーが発生しました: {e}\n")
 
+class ChatServer:
+    """複数のセッションを同時に扱うSSEサーバー（標準ライブラリのasyncioのみで実装）
+
+    POST /chat に {"session_id": ..., "input": ...} を送ると、回答を
+    Server-Sent Events（data: {"delta": ...}）で少しずつ返します。
+    - 同じセッションのリクエストは到着順に1つずつ処理する（セッションごとのロック）
+    - 同時に生成するリクエストは max_inflight 件まで
+    - 待ちが max_waiting 件を超えたら、受け付けずに503（Retry-After付き）を返す
+    """
+
+    def __init__(self, max_inflight=32, max_waiting=256):
+        self.semaphore = asyncio.Semaphore(max_inflight)
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.session_locks = {}  # session_id -> [ロック, 利用中のリクエスト数]
+        self.served = 0
+        self.rejected = 0
+        self.failed = 0
+
+    async def handle(self, reader, writer):
+        try:
+            request = await self._read_request(reader)
+            if request is None:
+                await self._send_error(writer, 400, "Bad Request")
+            elif request == "not found":
+                await self._send_error(writer, 404, "Not Found")
+            elif self.waiting >= self.max_waiting:
+                self.rejected += 1
+                await self._send_error(writer, 503, "Service Unavailable", "Retry-After: 1\r\n")
+            else:
+                await self._chat(writer, *request)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # クライアントが途中で切断した
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """リクエストを読み、(session_id, 入力) を返す"""
+        try:
+            method, path, _ = (await reader.readline()).decode().split(" ", 2)
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            if method != "POST" or path != "/chat":
+                return "not found"
+            payload = json.loads(body)
+            return str(payload["session_id"]), str(payload["input"])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    async def _send_error(self, writer, status, reason, extra_headers=""):
+        writer.write(f"HTTP/1.1 {status} {reason}\r\n{extra_headers}Content-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+
+    async def _send_event(self, writer, data, event=None):
+        line = f"event: {event}\n" if event else ""
+        writer.write(f"{line}data: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+        await writer.drain()  # 受信が遅いクライアントの分はここで待つ
+
+    async def _chat(self, writer, session_id, user_input):
+        entry = self.session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self.waiting += 1
+        started = False
+        try:
+            async with entry[0], self.semaphore:
+                self.waiting -= 1
+                started = True
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                             b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+                try:
+                    start = time.perf_counter()
+                    answer = fast_path.match(user_input)
+                    if answer is not None:
+                        get_session_history(session_id).add_messages([HumanMessage(user_input), AIMessage(answer)])
+                        await self._send_event(writer, {"delta": answer})
+                    else:
+                        config = {"configurable": {"session_id": session_id}}
+                        async for chunk in chatbot.astream({"input": user_input}, config=config):
+                            if chunk.content:
+                                await self._send_event(writer, {"delta": chunk.content})
+                    fast_path.record(answer is not None, time.perf_counter() - start)
+                except ConnectionError:
+                    raise  # クライアントが切断した場合は、エラーを送らずに終える
+                except Exception as e:
+                    # ステータスは送信済みのため、エラーはイベントとして伝える
+                    self.failed += 1
+                    print(f"応答の生成に失敗しました（{session_id}）: {e}")
+                    await self._send_event(writer, {"message": "応答の生成に失敗しました"}, event="error")
+                    return
+                await self._send_event(writer, {}, event="done")
+                self.served += 1
+        finally:
+            if not started:
+                self.waiting -= 1
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.session_locks[session_id]
+
+async def serve(host="127.0.0.1", port=8000, max_inflight=32, max_waiting=256):
+    """SSEサーバーを起動"""
+    server = ChatServer(max_inflight, max_waiting)
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"http://{host}:{port}/chat で待ち受けています（Ctrl+Cで終了）")
+    async with listener:
+        await listener.serve_forever()
+
+def benchmark_sessions(n=100_000, max_sessions=10_000, db_path="./tmp/bench_sessions.sqlite3"):
+    """n件のセッションを作成・保存・復元する時間を計測（トークン数は文字数で代用）"""
+    Path(db_path).unlink(missing_ok=True)
+    bench = SessionStore(db_path, max_sessions=max_sessions, flush_interval=0.5,
+                         token_counter=lambda m: len(m.content))
+    try:
+        start = time.perf_counter()
+        for i in range(n):
+            history = bench.get(f"user-{i}")
+            history.add_messages([HumanMessage(f"質問{i}"), AIMessage(f"回答{i}")])
+        created = time.perf_counter() - start
+
+        start = time.perf_counter()
+        flushed = bench.flush()
+        flush_time = time.perf_counter() - start
+
+        # 最近のセッション（メモリ上）と古いセッション（SQLiteから復元）の取得時間
+        start = time.perf_counter()
+        for i in range(n - 1000, n):
+            bench.get(f"user-{i}")
+        hot = (time.perf_counter() - start) / 1000
+        start = time.perf_counter()
+        for i in range(1000):
+            assert len(bench.get(f"user-{i}").messages) == 2
+        cold = (time.perf_counter() - start) / 1000
+
+        print(f"{n}セッション作成: {created:.2f}秒（{n / created:,.0f}件/秒）")
+        print(f"残りの書き込み: {flushed}件 {flush_time * 1000:.1f}ms")
+        print(f"取得（メモリ）: {hot * 1e6:.1f}µs/件, 取得（SQLiteから復元）: {cold * 1e6:.1f}µs/件")
+        print(f"統計: {bench.stats()}")
+    finally:
+        bench.close()
+        Path(db_path).unlink(missing_ok=True)
+
+def make_synthetic_faqs(n, seed=0):
+    """ベンチマーク用のFAQを生成"""
+    rng = random.Random(seed)
+    subjects = ["有給休暇", "交通費", "出張", "経費", "勤怠", "給与", "社会保険", "PC", "VPN", "会議室",
+                "名刺", "健康診断", "研修", "在宅勤務", "福利厚生", "年末調整", "住所変更", "入館証"]
+    actions = ["申請", "精算", "変更", "確認", "取消", "再発行", "問い合わせ", "登録"]
+    systems = ["勤怠管理システム", "経費精算システム", "人事ポータル", "社内ヘルプデスク", "総務部"]
+    faqs = []
+    for i in range(n):
+        subject, action = rng.choice(subjects), rng.choice(actions)
+        question = f"{subject}の{action}方法（ケース{i}）"
+        answer = (f"{rng.choice(systems)}から{subject}の{action}を行ってください。"
+                  f"手続きには{rng.randint(1, 10)}営業日かかります。詳細は{rng.choice(systems)}で確認できます。")
+        faqs.append((question, answer))
+    return faqs
+
+def benchmark_faq(sizes=(10, 1_000, 50_000), k=3, queries=200):
+    """FAQ件数ごとに、全件をプロンプトに入れる場合と上位k件だけの場合を比較"""
+    rng = random.Random(1)
+    for n in sizes:
+        faqs = make_synthetic_faqs(n)
+        manager = FAQManager()
+        start = time.perf_counter()
+        for question, answer in faqs:
+            manager.add(question, answer)
+        build = time.perf_counter() - start
+
+        samples = [rng.choice(faqs)[0].split("（")[0] + "について教えて" for _ in range(queries)]
+        start = time.perf_counter()
+        for query in samples:
+            context = manager.format_for_prompt(query, k=k)
+        search = (time.perf_counter() - start) / queries
+
+        start = time.perf_counter()
+        full_context = manager.format_for_prompt()
+        stuff = time.perf_counter() - start
+
+        print(f"=== FAQ {n:,}件 ===")
+        print(f"インデックス構築: {build * 1000:.1f}ms（{build / n * 1e6:.1f}µs/件）")
+        print(f"全件: {llm.get_num_tokens(full_context):,}トークン, 組み立て {stuff * 1000:.2f}ms")
+        print(f"上位{k}件: {llm.get_num_tokens(context):,}トークン, 検索＋組み立て {search * 1000:.2f}ms/質問")
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+async def send_chat(host, port, session_id, text):
+    """1リクエストを送り、(ステータス, 最初のイベントまでの秒数, 全体の秒数, doneまで届いたか) を返す"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        body = json.dumps({"session_id": session_id, "input": text}, ensure_ascii=False).encode()
+        writer.write(f"POST /chat HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        first_event = None
+        completed = False
+        while line := await reader.readline():
+            if first_event is None and line.startswith(b"data:"):
+                first_event = time.perf_counter() - start
+            if line.strip() == b"event: done":
+                completed = True
+        return status, first_event, time.perf_counter() - start, completed
+    finally:
+        writer.close()
+
+async def load_test(host="127.0.0.1", port=8000, levels=(1, 4, 16, 64), requests_per_level=64, sessions=16):
+    """同時接続数ごとにリクエストを送り、スループットとレイテンシの分位点を表示"""
+    questions = ["有給休暇の申請方法", "交通費の精算方法について", "在宅勤務の申請はどうすればいいですか？",
+                 "出張の経費はどう精算しますか？", "有給休暇の残日数はどこで確認できますか？"]
+    for concurrency in levels:
+        queue = asyncio.Queue()
+        for i in range(requests_per_level):
+            queue.put_nowait(i)
+        results = []
+
+        async def worker():
+            while not queue.empty():
+                i = queue.get_nowait()
+                try:
+                    results.append(await send_chat(host, port, f"load-{i % sessions}", questions[i % len(questions)]))
+                except (ConnectionError, OSError, IndexError, ValueError):
+                    results.append((None, None, None, False))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+        # 200でも、生成に失敗して done が届かなかったものは失敗として数える
+        ok = [r for r in results if r[0] == 200 and r[3]]
+        latencies = [r[2] for r in ok]
+        first_events = [r[1] for r in ok if r[1] is not None]
+        print(f"=== 同時接続数 {concurrency} ===")
+        print(f"成功: {len(ok)}/{len(results)}件, 503: {sum(r[0] == 503 for r in results)}件, "
+              f"生成エラー: {sum(r[0] == 200 and not r[3] for r in results)}件, "
+              f"スループット: {len(ok) / elapsed:.2f}件/秒")
+        print("レイテンシ p50/p95/p99: " + " / ".join(f"{percentile(latencies, p) * 1000:.0f}ms" for p in (50, 95, 99)))
+        print("最初の応答 p50/p95/p99: " + " / ".join(f"{percentile(first_events, p) * 1000:.0f}ms" for p in (50, 95, 99)))
+
 if __name__ == "__main__":
-    chat_mode()
+    parser = argparse.ArgumentParser(description="社内サポートチャットボット (FAQ対応)")
+    parser.add_argument("mode", nargs="?", default="chat",
+                        choices=["chat", "serve", "load-test", "bench-sessions", "bench-faq"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-inflight", type=int, default=32, help="同時に生成するリクエスト数の上限")
+    parser.add_argument("--levels", default="1,4,16,64", help="負荷試験の同時接続数（カンマ区切り）")
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port, args.max_inflight))
+        except KeyboardInterrupt:
+            print("サーバーを終了します。")
+            print(f"統計: {fast_path.report()}")
+    elif args.mode == "load-test":
+        levels = tuple(int(level) for level in args.levels.split(","))
+        asyncio.run(load_test(args.host, args.port, levels))
+    elif args.mode == "bench-sessions":
+        benchmark_sessions()
+    elif args.mode == "bench-faq":
+        benchmark_faq()
+    else:
+        chat_mode()
@@ -0,0 +1,111 @@
+"""
+トークン予算付きの会話履歴
+
+第4章のサンプルコード（4-3-5, 4-4-2）で共通して使うヘルパー
+予算に収まる直近のメッセージだけをモデルに渡し、古いものから順に外す
+
+使い方:
+    from token_budget_history import TokenBudgetChatMessageHistory, message_token_counter
+    history = TokenBudgetChatMessageHistory(message_token_counter(llm), max_tokens=1000)
+"""
+
+import json
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
+
+
+def message_token_counter(llm):
+    """llmのトークナイザーで1メッセージのトークン数を数える関数を返す"""
+    def count_message_tokens(message) -> int:
+        # ロールなどの付加分として4トークンを加算
+        content = message.content
+        text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+        if getattr(message, "tool_calls", None):
+            text += json.dumps(message.tool_calls, ensure_ascii=False)
+        return llm.get_num_tokens(text) + 4
+    return count_message_tokens
+
+
+class TokenBudgetChatMessageHistory(BaseChatMessageHistory):
+    """トークン予算に収まる直近のメッセージだけをモデルに渡す会話履歴
+
+    - トークン数はメッセージ追加時に1回だけ数えて保持する
+    - システムメッセージと pin() したメッセージは常に残す
+    - 古いメッセージは先頭から順に外す（各メッセージは1回しか外さないため償却O(1)）
+    - ツール呼び出し（tool_callsを持つAIMessage）とその結果（ToolMessage）は1つの組として残すか外す
+    """
+
+    def __init__(self, token_counter, max_tokens=1000, on_evict=None):
+        self.token_counter = token_counter
+        self.max_tokens = max_tokens
+        self.on_evict = on_evict  # 外したメッセージを受け取るコールバック（要約などに利用）
+        self.clear()
+
+    @property
+    def messages(self):
+        return self.pinned + self.window[self.start:]
+
+    @property
+    def total_tokens(self):
+        """モデルに渡る履歴のトークン数"""
+        return self.pinned_tokens + self.window_tokens
+
+    def add_message(self, message, pinned=False):
+        tokens = self.token_counter(message)
+        if pinned or isinstance(message, SystemMessage):
+            self.pinned.append(message)
+            self.pinned_tokens += tokens
+        else:
+            self.window.append(message)
+            self.token_counts.append(tokens)
+            self.window_tokens += tokens
+        self._trim()
+
+    def pin(self, message):
+        """予算に関係なく常に残すメッセージを追加"""
+        self.add_message(message, pinned=True)
+
+    def _unit_end(self, start):
+        """start から始まる組（ツール呼び出しと、それに続くToolMessage）の終わりの位置"""
+        end = start + 1
+        message = self.window[start]
+        if isinstance(message, ToolMessage) or (isinstance(message, AIMessage) and message.tool_calls):
+            while end < len(self.window) and isinstance(self.window[end], ToolMessage):
+                end += 1
+        return end
+
+    def _evict(self, end):
+        for i in range(self.start, end):
+            self.window_tokens -= self.token_counts[i]
+        evicted = self.window[self.start:end]
+        self.start = end
+        if self.on_evict is not None:
+            for message in evicted:
+                self.on_evict(message)
+
+    def _budget(self):
+        """ウィンドウに使えるトークン数（サブクラスで、要約などの分を差し引ける）"""
+        return self.max_tokens - self.pinned_tokens
+
+    def _trim(self):
+        budget = self._budget()
+        # 組ごとに外す（最新の組は予算を超えていても残す）
+        while self.window_tokens > budget and self.start < len(self.window):
+            end = self._unit_end(self.start)
+            if end >= len(self.window):
+                break
+            self._evict(end)
+        # 外したメッセージが半分を超えたらまとめて削除（リストの再構築も償却O(1)）
+        if self.start > len(self.window) // 2:
+            del self.window[:self.start]
+            del self.token_counts[:self.start]
+            self.start = 0
+
+    def clear(self):
+        self.pinned = []
+        self.pinned_tokens = 0
+        self.window = []
+        self.token_counts = []
+        self.window_tokens = 0
+        self.start = 0
@@ -17,6 +17,9 @@ from typing import List, Tuple
 from pathlib import Path
 from dotenv import load_dotenv
 
+# ベクトルの全件検索（正規化済みの行列と行列積で類似度を計算）
+from vector_search_engine import BruteForceIndex
+
 
 def prepare_documents() -> Tuple[List[str], str]:
     """サンプル文書とクエリを準備"""
@@ -138,13 +141,10 @@ def demo_vector_search(documents: List[str], query: str):
         print(f"   ベクトルの次元数: {len(doc_vectors[0])}次元")
 
         print("\n2. コサイン類似度を計算中...")
-        # コサイン類似度を計算
-        similarities = []
-        for doc_vec in doc_vectors:
-            similarity = np.dot(query_vector, doc_vec) / (
-                np.linalg.norm(query_vector) * np.linalg.norm(doc_vec)
-            )
-            similarities.append(similarity)
+        # コサイン類似度を計算（正規化済みの行列との行列積で全文書分をまとめて計算）
+        index = BruteForceIndex()
+        index.add(doc_vectors)
+        similarities = index.similarities(query_vector)
 
         print("\nベクトル検索の結果:")
         for i, sim in enumerate(similarities, 1):
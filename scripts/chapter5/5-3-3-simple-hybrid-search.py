@@ -10,13 +10,15 @@ RRF（Reciprocal Rank Fusion）を使用して結果を統合します。
 """
 
 import os
-import numpy as np
 from rank_bm25 import BM25Okapi
 from langchain_openai import OpenAIEmbeddings
 from typing import List, Dict, Tuple
 from pathlib import Path
 from dotenv import load_dotenv
 
+# ベクトルの全件検索（正規化済みの行列と行列積で類似度を計算）
+from vector_search_engine import BruteForceIndex
+
 def prepare_documents() -> Tuple[List[str], str]:
     """サンプル文書とクエリを準備"""
     documents = [
@@ -88,20 +90,13 @@ def vector_search(query: str, documents: List[str]) -> List[Tuple[int, float]]:
         doc_vectors = embeddings.embed_documents(documents)
         query_vector = embeddings.embed_query(query)
 
-        # コサイン類似度を計算
-        similarities = []
-        for doc_vec in doc_vectors:
-            similarity = np.dot(query_vector, doc_vec) / (
-                np.linalg.norm(query_vector) * np.linalg.norm(doc_vec)
-            )
-            similarities.append(similarity)
+        # コサイン類似度を行列積でまとめて計算し、類似度の降順に並べる
+        index = BruteForceIndex()
+        index.add(doc_vectors)
+        scores, ids = index.search([query_vector], k=len(documents))
 
         # (文書インデックス, 類似度)のリストを返す
-        results = [(i, sim) for i, sim in enumerate(similarities)]
-        # 類似度の降順でソート
-        results.sort(key=lambda x: x[1], reverse=True)
-
-        return results
+        return [(int(i), float(sim)) for i, sim in zip(ids[0], scores[0])]
 
     except Exception as e:
         print(f"エラー: {e}")
@@ -22,6 +22,9 @@ from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.documents import Document
 
+# 埋め込みキャッシュ（同じテキストはAPIを呼ばずに保存済みのベクトルを使う）
+from embedding_cache import CachedEmbeddings
+
 
 def load_faq_documents(data_dir: str = "sample_data") -> List[Document]:
     """FAQドキュメントを読み込む"""
@@ -87,7 +90,7 @@ def demo_vector_search():
 
     # 埋め込みとベクトルストアの作成
     print("\nベクトルストアを作成中...")
-    embeddings = OpenAIEmbeddings()
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
     vectorstore = Chroma.from_documents(
         documents=documents,
         embedding=embeddings,
@@ -95,6 +98,7 @@ def demo_vector_search():
     )
 
     print("ベクトルストアの作成が完了しました")
+    print(f"埋め込みキャッシュ: {embeddings.stats()}")
 
     # ベクトル検索のテスト
     print("\n" + "=" * 60)
@@ -123,7 +127,7 @@ def create_rag_pipeline(vectorstore=None):
             print("エラー: ドキュメントが読み込めませんでした")
             return None
 
-        embeddings = OpenAIEmbeddings()
+        embeddings = CachedEmbeddings(OpenAIEmbeddings())
         vectorstore = Chroma.from_documents(
             documents=documents,
             embedding=embeddings,
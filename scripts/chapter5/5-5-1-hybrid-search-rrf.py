@@ -22,6 +22,9 @@ from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+# 埋め込みキャッシュ（同じテキストはAPIを呼ばずに保存済みのベクトルを使う）
+from embedding_cache import CachedEmbeddings
+
 
 def load_documents_from_files() -> List[Document]:
     """hybrid_sample_data/ディレクトリからドキュメントを読み込み"""
@@ -105,7 +108,7 @@ def compare_retrieval_methods(splits: List[Document]):
     bm25_retriever.k = 3
 
     # 2. ベクトル検索 Retrieverの構築
-    embeddings = OpenAIEmbeddings()
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
     vectorstore = Chroma.from_documents(
         documents=splits,
         embedding=embeddings,
@@ -167,7 +170,7 @@ def demonstrate_ensemble_retriever(splits: List[Document]):
     bm25_retriever.k = 12  # 多めに候補を取得
 
     # ベクトル検索 Retrieverの構築
-    embeddings = OpenAIEmbeddings()
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
     vectorstore = Chroma.from_documents(
         documents=splits,
         embedding=embeddings,
@@ -6,6 +6,8 @@
 社内規定文書を使った完全なRAGシステムの実装
 """
 
+import hashlib
+import json
 import os
 import sys
 import yaml
@@ -25,53 +27,191 @@ from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+# 埋め込みキャッシュ（同じテキストはAPIを呼ばずに保存済みのベクトルを使う）
+from embedding_cache import CachedEmbeddings
 
-def load_company_documents(data_dir: str = "company_docs") -> List[Document]:
-    """YAMLフロントマター付き社内規定文書を読み込む"""
-    data_path = Path(data_dir)
 
-    if not data_path.exists():
-        print(f"エラー: {data_dir}ディレクトリが存在しません")
-        return []
+def load_company_document(file_path: Path) -> Optional[Document]:
+    """YAMLフロントマター付きの社内規定文書を1件読み込む"""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
 
-    documents = []
+        # YAMLフロントマターの解析
+        if content.startswith('---'):
+            parts = content.split('---', 2)
+            metadata = yaml.safe_load(parts[1])
+            text_content = parts[2].strip()
+        else:
+            metadata = {}
+            text_content = content.strip()
+
+        # デフォルトメタデータを追加
+        metadata.setdefault('source', file_path.name)
+        metadata.setdefault('id', file_path.stem)
 
-    # .txtファイルを読み込み
-    txt_files = sorted(data_path.glob("*.txt"))
+        return Document(
+            page_content=text_content,
+            metadata=metadata
+        )
+    except Exception as e:
+        print(f"エラー: {file_path}の読み込みに失敗: {e}")
+        return None
 
-    if not txt_files:
-        print(f"警告: {data_dir}に文書ファイルが見つかりません")
-        return []
 
-    print(f"{len(txt_files)}個の社内規定ファイルを読み込み中...")
+def create_text_splitter() -> RecursiveCharacterTextSplitter:
+    """チャンク分割の設定"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=800,
+        chunk_overlap=160,
+        separators=["\n\n", "\n", "。", "、", " ", ""]
+    )
 
-    for file_path in txt_files:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
 
-            # YAMLフロントマターの解析
-            if content.startswith('---'):
-                parts = content.split('---', 2)
-                metadata = yaml.safe_load(parts[1])
-                text_content = parts[2].strip()
-            else:
-                metadata = {}
-                text_content = content.strip()
+class IncrementalIndex:
+    """社内規定文書の永続インデックス
+
+    ファイルごとに（更新日時・内容のハッシュ・チャンクID）をマニフェストに記録し、
+    起動時には変更のあったファイルだけを分割・埋め込みし直してChromaに反映する。
+    BM25用にチャンクの本文もマニフェストに保存するため、変更がなければ
+    ファイルの読み込みも分割も行わずに起動できる。
+    """
+
+    def __init__(
+        self,
+        data_dir: str = "company_docs",
+        index_dir: str = "./tmp/rag_index",
+        collection_name: str = "rag_pipeline",
+    ):
+        self.data_dir = Path(data_dir)
+        self.manifest_path = Path(index_dir) / "manifest.json"
+        self.text_splitter = create_text_splitter()
+        self.embeddings = CachedEmbeddings(OpenAIEmbeddings())
+        self.vectorstore = Chroma(
+            collection_name=collection_name,
+            embedding_function=self.embeddings,
+            persist_directory=str(Path(index_dir) / "chroma"),
+        )
+        self.manifest = {}
+        self._bm25 = None  # BM25の統計（同期で変更があった場合のみ作り直す）
+        if self.manifest_path.exists():
+            self.manifest = json.loads(self.manifest_path.read_text(encoding='utf-8'))
+
+        # Chromaの中身とマニフェストが食い違う場合（片方だけ削除した等）は作り直す
+        chunk_ids = {c["id"] for entry in self.manifest.values() for c in entry["chunks"]}
+        stored_ids = self.vectorstore.get(include=[])["ids"]
+        if chunk_ids != set(stored_ids):
+            if stored_ids:
+                self.vectorstore.delete(ids=stored_ids)
+            self.manifest = {}
+
+    def _save_manifest(self):
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        self.manifest_path.write_text(
+            json.dumps(self.manifest, ensure_ascii=False, indent=2, default=str),
+            encoding='utf-8'
+        )
 
-            # デフォルトメタデータを追加
-            metadata.setdefault('source', file_path.name)
-            metadata.setdefault('id', file_path.stem)
+    def sync(self) -> dict:
+        """文書フォルダとインデックスを同期し、追加・更新・削除・変更なしの件数を返す"""
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        seen = set()
+
+        for file_path in sorted(self.data_dir.glob("*.txt")):
+            name = file_path.name
+            seen.add(name)
+            entry = self.manifest.get(name)
+            mtime = file_path.stat().st_mtime
+
+            # 更新日時が同じなら読み込みもしない
+            if entry and entry["mtime"] == mtime:
+                stats["unchanged"] += 1
+                continue
+
+            content_hash = hashlib.sha256(file_path.read_bytes()).hexdigest()
+            if entry and entry["hash"] == content_hash:
+                entry["mtime"] = mtime  # 内容は同じ（touchされただけ）
+                stats["unchanged"] += 1
+                continue
+
+            doc = load_company_document(file_path)
+            if doc is None:
+                continue
+            splits = self.text_splitter.split_documents([doc])
+            ids = [f"{name}#{i}" for i in range(len(splits))]
+
+            # 古いチャンクを削除してから追加する（チャンク数が減った場合も残らない）
+            if entry:
+                self.vectorstore.delete(ids=[c["id"] for c in entry["chunks"]])
+            if splits:
+                self.vectorstore.add_documents(splits, ids=ids)
+
+            self.manifest[name] = {
+                "mtime": mtime,
+                "hash": content_hash,
+                "chunks": [
+                    {"id": chunk_id, "page_content": split.page_content, "metadata": split.metadata}
+                    for chunk_id, split in zip(ids, splits)
+                ],
+            }
+            stats["updated" if entry else "added"] += 1
+
+        # 削除されたファイルのチャンクを取り除く
+        for name in [n for n in self.manifest if n not in seen]:
+            chunk_ids = [c["id"] for c in self.manifest.pop(name)["chunks"]]
+            if chunk_ids:
+                self.vectorstore.delete(ids=chunk_ids)
+            stats["removed"] += 1
+
+        if stats["added"] or stats["updated"] or stats["removed"]:
+            self._bm25 = None
+        self._save_manifest()
+        return stats
+
+    def splits(self) -> List[Document]:
+        """インデックス済みの全チャンク（BM25用）"""
+        return [
+            Document(page_content=c["page_content"], metadata=c["metadata"], id=c["id"])
+            for entry in self.manifest.values()
+            for c in entry["chunks"]
+        ]
 
-            doc = Document(
-                page_content=text_content,
-                metadata=metadata
-            )
-            documents.append(doc)
-        except Exception as e:
-            print(f"エラー: {file_path}の読み込みに失敗: {e}")
+    # 以下のRetrieverはすべて同じインデックス（Chromaのベクトル・BM25の統計）を共有し、
+    # kや重みを変えても分割・埋め込み・BM25の再計算は行わない
+
+    def vector_retriever(self, k: int = 4):
+        """ベクトル検索のRetriever"""
+        return self.vectorstore.as_retriever(search_kwargs={"k": k})
+
+    def bm25_retriever(self, k: int = 4) -> BM25Retriever:
+        """BM25のRetriever（統計は1回だけ計算し、kだけを変えたコピーを返す）"""
+        if self._bm25 is None:
+            self._bm25 = BM25Retriever.from_documents(self.splits())
+        return self._bm25.model_copy(update={"k": k})
+
+    def hybrid_retriever(
+        self,
+        k: int = 8,
+        weights: Tuple[float, float] = (0.6, 1.0),
+        c: int = 60,
+    ) -> EnsembleRetriever:
+        """BM25とベクトル検索をRRFで統合するRetriever"""
+        return EnsembleRetriever(
+            retrievers=[self.bm25_retriever(k), self.vector_retriever(k)],
+            weights=list(weights),
+            c=c,
+        )
 
-    return documents
+    def retriever(self, mode: str = "vector", **kwargs):
+        """モード名（vector / bm25 / hybrid）からRetrieverを作る"""
+        factories = {
+            "vector": self.vector_retriever,
+            "bm25": self.bm25_retriever,
+            "hybrid": self.hybrid_retriever,
+        }
+        if mode not in factories:
+            raise ValueError(f"未対応の検索モードです: {mode}")
+        return factories[mode](**kwargs)
 
 
 def format_docs(docs: List[Document]) -> str:
@@ -91,72 +231,29 @@ def format_docs(docs: List[Document]) -> str:
 
 
 def create_rag_pipeline(
-    documents: Optional[List[Document]] = None,
-    use_hybrid: bool = False
+    index: Optional[IncrementalIndex] = None,
+    mode: str = "vector",
+    **retriever_kwargs
 ) -> Tuple:
-    """統合RAGパイプラインの構築"""
+    """統合RAGパイプラインの構築
 
-    # ドキュメントが渡されない場合はロード
-    if documents is None:
-        documents = load_company_documents()
-        if not documents:
-            print("エラー: ドキュメントが読み込めませんでした")
-            return None, None
+    インデックスの構築（IncrementalIndex）とRetrieverの設定を分けているため、
+    同じインデックスからモードやk・重みの違うパイプラインを何度でも作れる。
+    """
 
-    print(f"✓ {len(documents)}個のドキュメントを処理中...")
+    # インデックスが渡されない場合は同期してから使う
+    if index is None:
+        index = IncrementalIndex()
+        index.sync()
 
-    # テキストの分割
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800,
-        chunk_overlap=160,
-        separators=["\n\n", "\n", "。", "、", " ", ""]
-    )
-    splits = text_splitter.split_documents(documents)
-    print(f"✓ {len(splits)}個のチャンクに分割しました")
-
-    # 埋め込みモデル
-    embeddings = OpenAIEmbeddings()
+    if not index.manifest:
+        print("エラー: インデックスにチャンクがありません")
+        return None, None
 
     # Retrieverの構築
-    if use_hybrid:
-        print("✓ ハイブリッド検索モードを使用")
-
-        # BM25 Retriever
-        bm25_retriever = BM25Retriever.from_documents(splits)
-        bm25_retriever.k = 8
-
-        # Vector Store Retriever
-        vectorstore = Chroma.from_documents(
-            splits,
-            embeddings,
-            collection_name="rag_pipeline"
-        )
-        print("  - Chromaベクトルストアを使用")
-
-        dense_retriever = vectorstore.as_retriever(search_kwargs={"k": 8})
-
-        hybrid_retriever = EnsembleRetriever(
-            retrievers=[bm25_retriever, dense_retriever],
-            weights=[0.6, 1.0],
-            c=60,
-        )
-
-        context_runnable = RunnableLambda(
-            lambda question: format_docs(hybrid_retriever.invoke(question))
-        )
-    else:
-        print("✓ ベクトル検索モードを使用")
-
-        # Vector Store only
-        vectorstore = Chroma.from_documents(
-            splits,
-            embeddings,
-            collection_name="rag_pipeline"
-        )
-        print("  - Chromaベクトルストアを使用")
-
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
-        context_runnable = retriever | format_docs
+    retriever = index.retriever(mode, **retriever_kwargs)
+    print(f"✓ 検索モード: {mode} {retriever_kwargs}")
+    context_runnable = retriever | RunnableLambda(format_docs)
 
     # プロンプトテンプレート（出典必須・ガードレール付き）
     template = """以下の参考文書を基に質問に回答してください。
@@ -193,7 +290,7 @@ def create_rag_pipeline(
         | StrOutputParser()
     )
 
-    return rag_chain, vectorstore
+    return rag_chain, index.vectorstore
 
 
 def main():
@@ -206,32 +303,36 @@ def main():
         print("エラー: OPENAI_API_KEY環境変数が設定されていません")
         sys.exit(1)
 
-    # 社内規定文書を読み込み
+    # 社内規定文書のインデックスを同期（変更のあったファイルだけを処理）
     print("\n" + "=" * 60)
-    print("社内規定文書を読み込み中...")
+    print("社内規定文書のインデックスを同期中...")
     print("=" * 60)
 
-    documents = load_company_documents()
-
-    if not documents:
-        print("エラー: 文書が読み込めませんでした")
-        return
+    index = IncrementalIndex()
+    stats = index.sync()
+    print(f"✓ 追加: {stats['added']}, 更新: {stats['updated']}, "
+          f"削除: {stats['removed']}, 変更なし: {stats['unchanged']}")
+    print(f"✓ 埋め込みキャッシュ: {index.embeddings.stats()}")
 
     # RAGパイプラインの構築
     print("\n" + "=" * 60)
     print("RAGパイプラインを構築中...")
     print("=" * 60)
 
-    # ベクトル検索のみとハイブリッド検索の両方をデモ
-    for use_hybrid in [False, True]:
-        mode_name = "ハイブリッド検索" if use_hybrid else "ベクトル検索"
-
+    # 同じインデックスから、ベクトル検索・BM25・ハイブリッド検索をデモ
+    modes = [
+        ("ベクトル検索", "vector", {"k": 4}),
+        ("キーワード検索（BM25）", "bm25", {"k": 4}),
+        ("ハイブリッド検索", "hybrid", {"k": 8, "weights": (0.6, 1.0)}),
+    ]
+    for mode_name, mode, retriever_kwargs in modes:
         print(f"\n\n### {mode_name}モード ###")
         print("-" * 60)
 
         rag_chain, vectorstore = create_rag_pipeline(
-            documents=documents,
-            use_hybrid=use_hybrid
+            index=index,
+            mode=mode,
+            **retriever_kwargs
         )
 
         if rag_chain is None:
@@ -255,10 +356,6 @@ def main():
 
             print("-" * 40)
 
-        # クリーンアップ
-        if vectorstore:
-            vectorstore.delete_collection()
-
     print("\n" + "=" * 60)
     print("✓ すべての処理が完了しました")
     print("=" * 60)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+埋め込みベクトルのキャッシュ
+
+第5章のサンプルコードで共通して使うヘルパー
+同じテキストを何度も埋め込まないよう、ベクトルをSQLiteに保存して再利用する
+
+使い方:
+    from embedding_cache import CachedEmbeddings
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+"""
+
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddingsのラッパー（ベクトルをテキストのハッシュで保存し、未保存の分だけAPIを呼ぶ）
+
+    キーは「モデル名・次元数・正規化したテキスト」のハッシュなので、
+    モデルや次元数を変えた場合は別のベクトルとして扱われます。
+    ベクトルはfloat32のバイト列としてSQLiteに保存します。
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        db_path: str = "./tmp/embedding_cache.sqlite3",
+        batch_size: int = 256,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        model = getattr(embeddings, "model", type(embeddings).__name__)
+        dimensions = getattr(embeddings, "dimensions", None)
+        self.namespace = f"{model}:{dimensions}"
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # LCELのRunnableParallelなど、別スレッドから呼ばれても使えるようにロックで保護する
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self.conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """表記ゆれ（全角・半角など）と前後の空白をそろえる"""
+        return unicodedata.normalize("NFKC", text).strip()
+
+    def _key(self, text: str, kind: str) -> str:
+        return hashlib.sha256(f"{self.namespace}:{kind}\n{text}".encode()).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        """保存済みのベクトルをまとめて取得（SQLiteの変数上限を超えないよう分割）"""
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _embed(self, texts: List[str], kind: str, embed_batch) -> List[List[float]]:
+        normalized = [self.normalize(t) for t in texts]
+        keys = [self._key(t, kind) for t in normalized]
+        vectors = self._lookup(list(dict.fromkeys(keys)))
+
+        # 未保存のテキストだけを重複なしでまとめて埋め込む
+        missing = {}
+        for key, text in zip(keys, normalized):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        with self.lock:
+            self.hits += len(keys) - sum(1 for k in keys if k in missing)
+            self.misses += len(missing)
+
+        pending = list(missing.items())
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i + self.batch_size]
+            embedded = embed_batch([text for _, text in batch])
+            rows = []
+            for (key, _), vector in zip(batch, embedded):
+                array = np.asarray(vector, dtype=np.float32)
+                vectors[key] = array.tolist()
+                rows.append((key, array.tobytes()))
+            with self.lock, self.conn:
+                self.api_calls += 1
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows
+                )
+
+        return [vectors[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "document", self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        # クエリ用の埋め込みが文書用と異なるモデルもあるため、別のキーで保存する
+        return self._embed([text], "query", lambda batch: [self.embeddings.embed_query(batch[0])])[0]
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """ヒット数・ミス数・API呼び出し回数"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "api_calls": self.api_calls,
+            "hit_rate": self.hits / total if total else None,
+        }
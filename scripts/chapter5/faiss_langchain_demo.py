@@ -18,6 +18,9 @@ from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+# 埋め込みキャッシュ（同じテキストはAPIを呼ばずに保存済みのベクトルを使う）
+from embedding_cache import CachedEmbeddings
+
 
 def create_technical_documents() -> List[Document]:
     """技術文書のサンプルを作成"""
@@ -81,7 +84,7 @@ def demonstrate_faiss_operations():
     splits = text_splitter.split_documents(documents)
 
     # 埋め込みモデルの初期化
-    embeddings = OpenAIEmbeddings()
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
 
     # FAISSベクトルストアの作成
     print("\n1. FAISSベクトルストアを作成中...")
@@ -90,6 +93,7 @@ def demonstrate_faiss_operations():
         embedding=embeddings
     )
     print(f"   → {len(splits)}個のドキュメントをインデックスに追加しました。")
+    print(f"   → 埋め込みキャッシュ: {embeddings.stats()}")
 
     # インデックスの保存
     index_path = "faiss_index"
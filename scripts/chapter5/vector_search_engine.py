@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+"""
+ベクトルの全件検索エンジン（正確な検索）
+
+第5章のサンプルコードで共通して使うヘルパー
+正規化済みのベクトルを1つの連続したfloat32行列に保持し、
+複数のクエリを1回の行列積でスコア計算して、上位k件をargpartitionで選ぶ
+
+使い方:
+    from vector_search_engine import BruteForceIndex
+    index = BruteForceIndex()
+    index.add(doc_vectors)
+    scores, ids = index.search([query_vector], k=3)
+
+ディスクに保存して、メモリマップで開く:
+    store = VectorStoreFile.save("./tmp/vector_store", doc_vectors, texts, metadatas)
+    store = VectorStoreFile("./tmp/vector_store")   # 数GBでも数ミリ秒で開ける
+    results = store.search([query_vector], k=3)
+
+ベンチマーク:
+    uv run python vector_search_engine.py
+    uv run python vector_search_engine.py --store   # 保存したストアを開く時間
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+class BruteForceIndex:
+    """コサイン類似度による全件検索
+
+    - 追加時に1回だけ正規化するため、検索は内積（行列積）だけで済む
+    - 行列は容量を倍々に確保して追加するため、追加のコストは償却O(1)
+    - 上位k件は全件ソートせず、argpartitionで選んでからk件だけをソートする
+    """
+
+    def __init__(self, dim: int = None, max_block: int = 64_000_000):
+        self.dim = dim
+        self.size = 0
+        self.matrix = np.empty((0, dim or 0), dtype=np.float32)
+        self.max_block = max_block  # 一度に作るスコア行列の要素数の上限（メモリ使用量の目安）
+
+    @classmethod
+    def from_normalized(cls, matrix: np.ndarray) -> "BruteForceIndex":
+        """正規化済みの行列（np.memmapでもよい）をコピーせずに使う"""
+        index = cls(dim=matrix.shape[1])
+        index.matrix = matrix
+        index.size = len(matrix)
+        return index
+
+    @staticmethod
+    def normalize(vectors) -> np.ndarray:
+        """float32に変換し、各行をL2ノルムで割る（ゼロベクトルはそのまま）"""
+        array = np.asarray(vectors, dtype=np.float32)
+        if array.ndim == 1:
+            array = array[None, :]
+        norms = np.linalg.norm(array, axis=1, keepdims=True)
+        return array / np.where(norms == 0, 1, norms)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """登録済みの（正規化済み）ベクトル"""
+        return self.matrix[:self.size]
+
+    def add(self, vectors) -> np.ndarray:
+        """ベクトルを追加し、割り当てた番号を返す"""
+        array = self.normalize(vectors)
+        if self.dim is None:
+            self.dim = array.shape[1]
+            self.matrix = np.empty((0, self.dim), dtype=np.float32)
+        if array.shape[1] != self.dim:
+            raise ValueError(f"次元数が一致しません: {array.shape[1]} != {self.dim}")
+
+        needed = self.size + len(array)
+        if needed > len(self.matrix):
+            capacity = max(needed, 2 * len(self.matrix), 1024)
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown[:self.size] = self.matrix[:self.size]
+            self.matrix = grown
+        self.matrix[self.size:needed] = array
+        ids = np.arange(self.size, needed)
+        self.size = needed
+        return ids
+
+    def similarities(self, query) -> np.ndarray:
+        """1つのクエリと全ベクトルのコサイン類似度"""
+        return self.vectors @ self.normalize(query)[0]
+
+    def search(self, queries, k: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+        """複数のクエリの上位k件を (類似度, 番号) の2つの (クエリ数, k) 配列で返す"""
+        queries = self.normalize(queries)
+        k = min(k, self.size)
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+
+        scores_out = np.empty((len(queries), k), dtype=np.float32)
+        ids_out = np.empty((len(queries), k), dtype=np.int64)
+        # クエリ数×文書数のスコア行列が大きくなりすぎないよう、クエリを分けて計算
+        block = max(1, self.max_block // max(self.size, 1))
+        for start in range(0, len(queries), block):
+            scores = queries[start:start + block] @ self.vectors.T
+            if k < self.size:
+                top = np.argpartition(scores, -k, axis=1)[:, -k:]
+            else:
+                top = np.broadcast_to(np.arange(self.size), scores.shape)
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            ids_out[start:start + block] = np.take_along_axis(top, order, axis=1)
+            scores_out[start:start + block] = np.take_along_axis(top_scores, order, axis=1)
+        return scores_out, ids_out
+
+
+class VectorStoreFile:
+    """ディスク上のベクトルストア（ベクトルはメモリマップで開くため、起動時に読み込まない）
+
+    ディレクトリの構成:
+        header.json  … 形式のバージョン・次元数・件数（最後に書くため、途中で止まった保存は開けない）
+        vectors.npy  … 正規化済みのfloat32行列（件数×次元数）
+        docs.jsonl   … 1行1件の本文とメタデータ
+        offsets.npy  … docs.jsonl の各行の開始位置（必要な行だけを読むため）
+
+    読み取り専用で開くため、同じファイルを開いた複数のプロセスはOSのページキャッシュを共有します。
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        header_path = self.path / "header.json"
+        if not header_path.exists():
+            raise FileNotFoundError(f"ベクトルストアが見つかりません: {self.path}")
+        self.header = json.loads(header_path.read_text(encoding="utf-8"))
+        if self.header.get("version") != FORMAT_VERSION:
+            raise ValueError(
+                f"対応していない形式のバージョンです: {self.header.get('version')}（対応: {FORMAT_VERSION}）"
+            )
+
+        vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
+        if vectors.shape != (self.header["count"], self.header["dim"]) or vectors.dtype != np.float32:
+            raise ValueError(f"ヘッダーとベクトルが一致しません: {vectors.shape} {vectors.dtype}")
+        self.index = BruteForceIndex.from_normalized(vectors)
+        self.offsets = np.load(self.path / "offsets.npy", mmap_mode="r")
+        # 空のファイルはメモリマップできないため、文書がない場合は使わない
+        docs_path = self.path / "docs.jsonl"
+        self.docs = np.memmap(docs_path, dtype=np.uint8, mode="r") if docs_path.stat().st_size else None
+
+    def __len__(self) -> int:
+        return self.index.size
+
+    @classmethod
+    def save(
+        cls,
+        path: str,
+        vectors,
+        texts: Sequence[str],
+        metadatas: Optional[Sequence[Dict]] = None,
+        chunk_size: int = 100_000,
+    ) -> "VectorStoreFile":
+        """ベクトルと文書を保存して開く（同じパスにあるストアは置き換え、ストア以外のディレクトリならエラー）"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError(f"ベクトルと文書の件数が一致しません: {vectors.shape} / {len(texts)}")
+        metadatas = metadatas or [{}] * len(texts)
+
+        path = Path(path)
+        if path.exists() and not (path / "header.json").exists():
+            # 誤ったパスを指定しても、ストア以外のディレクトリは消さない
+            raise ValueError(f"ベクトルストアではないため置き換えられません: {path}")
+
+        # 同じ階層の一時ディレクトリに書いてから置き換える（開いている他のプロセスは古いファイルを使い続けられる）
+        tmp = path.with_name(f".{path.name}.tmp-{os.getpid()}")
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir(parents=True)
+        try:
+            cls._write(tmp, vectors, texts, metadatas, chunk_size)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        # 書き終えたディレクトリと入れ替える（ヘッダーのないストアが見えることはない）
+        old = path.with_name(f".{path.name}.old-{os.getpid()}")
+        if old.exists():
+            shutil.rmtree(old)
+        if path.exists():
+            path.rename(old)
+        tmp.rename(path)
+        if old.exists():
+            shutil.rmtree(old)
+        return cls(path)
+
+    @staticmethod
+    def _write(path: Path, vectors: np.ndarray, texts: Sequence[str], metadatas: Sequence[Dict], chunk_size: int):
+        """ベクトル・文書・ヘッダーを path に書き込む（ヘッダーは最後）"""
+        # 大きな行列でもメモリを二重に使わないよう、分割して正規化しながら書き込む
+        out = np.lib.format.open_memmap(path / "vectors.npy", mode="w+", dtype=np.float32, shape=vectors.shape)
+        for start in range(0, len(vectors), chunk_size):
+            out[start:start + chunk_size] = BruteForceIndex.normalize(vectors[start:start + chunk_size])
+        out.flush()
+        del out
+
+        offsets = np.empty(len(texts) + 1, dtype=np.int64)
+        with open(path / "docs.jsonl", "wb") as f:
+            offsets[0] = 0
+            for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+                line = json.dumps({"text": text, "metadata": metadata}, ensure_ascii=False) + "\n"
+                offsets[i + 1] = offsets[i] + f.write(line.encode("utf-8"))
+        np.save(path / "offsets.npy", offsets)
+
+        header = {"version": FORMAT_VERSION, "dtype": "float32", "dim": vectors.shape[1], "count": len(texts)}
+        (path / "header.json").write_text(json.dumps(header), encoding="utf-8")
+
+    def document(self, i: int) -> Dict:
+        """i番目の文書（本文とメタデータ）をその1行だけ読んで返す"""
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return json.loads(bytes(self.docs[start:end]).decode("utf-8"))
+
+    def search(self, queries, k: int = 4) -> List[List[Tuple[Dict, float]]]:
+        """クエリごとに上位k件の (文書, 類似度) のリストを返す"""
+        scores, ids = self.index.search(queries, k)
+        return [
+            [(self.document(int(i)), float(score)) for i, score in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+
+
+def loop_search(query: Sequence[float], doc_vectors: Sequence[Sequence[float]], k: int = 4):
+    """従来の方法（文書ごとにノルムを計算し、全件をソート）"""
+    similarities = []
+    for doc_vec in doc_vectors:
+        similarity = np.dot(query, doc_vec) / (np.linalg.norm(query) * np.linalg.norm(doc_vec))
+        similarities.append(similarity)
+    results = [(i, sim) for i, sim in enumerate(similarities)]
+    results.sort(key=lambda x: x[1], reverse=True)
+    return results[:k]
+
+
+def benchmark(sizes=(10_000, 100_000, 1_000_000), dim: int = 256, n_queries: int = 100, k: int = 10):
+    """従来のループと、行列積＋argpartitionの検索時間を比較"""
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((n_queries, dim), dtype=np.float32)
+
+    for n in sizes:
+        docs = rng.standard_normal((n, dim), dtype=np.float32)
+        index = BruteForceIndex()
+        start = time.perf_counter()
+        index.add(docs)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index.search(queries, k)
+        engine = (time.perf_counter() - start) / n_queries
+
+        # ループは遅いため、文書の一部で計測して全件分を推定
+        sample = min(n, 5_000)
+        doc_list = docs[:sample].tolist()
+        start = time.perf_counter()
+        expected = loop_search(queries[0].tolist(), doc_list, k)
+        loop = (time.perf_counter() - start) * n / sample
+
+        # 同じ一部の文書で作ったインデックスの結果が、ループの結果と一致することを確認
+        sample_index = BruteForceIndex()
+        sample_index.add(docs[:sample])
+        _, sample_ids = sample_index.search(queries[:1], k)
+        assert [i for i, _ in expected] == sample_ids[0].tolist(), "ループの結果と一致しません"
+
+        print(f"文書 {n:>9,}件 ({dim}次元): 登録 {build * 1000:8.1f}ms | "
+              f"検索 {engine * 1000:8.3f}ms/クエリ | ループ（推定） {loop * 1000:10.1f}ms/クエリ | "
+              f"{loop / engine:,.0f}倍")
+
+
+def benchmark_store(n: int = 1_000_000, dim: int = 256, path: str = "./tmp/vector_store_bench"):
+    """保存したストアを開く時間を、全件を読み込む方法と比較"""
+    rng = np.random.default_rng(0)
+    docs = rng.standard_normal((n, dim), dtype=np.float32)
+    texts = [f"文書{i}" for i in range(n)]
+    start = time.perf_counter()
+    VectorStoreFile.save(path, docs, texts, [{"id": i} for i in range(n)])
+    size = (Path(path) / "vectors.npy").stat().st_size
+    print(f"保存: {n:,}件 × {dim}次元（{size / 1024 ** 3:.2f}GB） {time.perf_counter() - start:.1f}秒")
+    del docs
+
+    start = time.perf_counter()
+    store = VectorStoreFile(path)
+    print(f"メモリマップで開く: {(time.perf_counter() - start) * 1000:8.2f}ms")
+
+    query = rng.standard_normal(dim, dtype=np.float32)
+    for label in ("1回目の検索", "2回目の検索"):
+        start = time.perf_counter()
+        results = store.search([query], k=3)
+        print(f"{label}: {(time.perf_counter() - start) * 1000:8.2f}ms → {[d['text'] for d, _ in results[0]]}")
+
+    start = time.perf_counter()
+    np.load(Path(path) / "vectors.npy")
+    print(f"全件をメモリに読み込む: {(time.perf_counter() - start) * 1000:8.2f}ms")
+
+    # Pythonのfloatのリストとして保存した場合（一部で計測して全件分を推定）
+    sample = min(n, 10_000)
+    encoded = json.dumps(np.asarray(store.index.vectors[:sample]).tolist())
+    start = time.perf_counter()
+    json.loads(encoded)
+    print(f"floatのリストをJSONから読み込む（推定）: {(time.perf_counter() - start) * n / sample * 1000:8.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ベクトル全件検索のベンチマーク")
+    parser.add_argument("--store", action="store_true", help="保存したストアを開く時間を計測")
+    args = parser.parse_args()
+    if args.store:
+        benchmark_store()
+    else:
+        benchmark()
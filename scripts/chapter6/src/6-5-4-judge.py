@@ -23,6 +23,111 @@ except Exception:
 
 dataset = lf.get_dataset(name=DATASET)
 
+LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+def _repair_from(text):
+    """text の先頭の括弧から始まるJSONを直す（値の途中で切れていればエラーにする）"""
+    out = []
+    stack = []
+    quote = None  # 文字列の中なら、その開始の引用符
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == "\\" and i + 1 < len(text):
+                nxt = text[i + 1]
+                out.append(nxt if (quote == "'" and nxt == "'") else ch + nxt)
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+        elif ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            while out and out[-1] in " \t\r\n,":
+                out.pop()
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                break
+        elif ch.isalpha():
+            word = re.match(r"\w+", text[i:]).group(0)
+            out.append(LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    repaired = "".join(out).rstrip()
+    if stack:
+        # 最後のトークンが完結している場合だけ閉じる（{"score": 0 のような途中切れは採点に使わない）
+        if quote or not re.search(r'([{}\[\],"]|\b(?:true|false|null))$', repaired):
+            raise json.JSONDecodeError("output is truncated", text, len(text))
+        repaired = repaired.rstrip(" \t\r\n,")
+    return repaired + "".join(reversed(stack))
+
+def repair_json(text):
+    """コードブロック・前後の文章・末尾のカンマ・シングルクォート・閉じ括弧の欠けを機械的に直す"""
+    fence = re.search(r"```(?:json)?\s*(.*?)(?:```|$)", text, re.S)
+    if fence and re.search(r"[{\[]", fence.group(1)):
+        text = fence.group(1)
+    starts = [m.start() for m in re.finditer(r"[{\[]", text)]
+    if not starts:
+        return text.strip()
+    # 前の文章の括弧は読み飛ばし、JSONとして読める最初の位置から始める
+    error = None
+    for start in starts:
+        try:
+            repaired = _repair_from(text[start:])
+            json.loads(repaired)
+            return repaired
+        except json.JSONDecodeError as e:
+            error = error or e
+    raise error
+
+# パース結果の集計（そのまま成功・ローカルで修復・再問い合わせ・失敗）
+parse_stats = {"ok": 0, "repaired": 0, "reasked": 0, "failed": 0}
+
+def parse_judge(txt):
+    """採点結果のJSONを読む（壊れていればローカルで修復し、それでもだめならNone）"""
+    try:
+        js = json.loads(txt)
+        if isinstance(js, dict):
+            return js, False
+    except json.JSONDecodeError:
+        pass
+    try:
+        js = json.loads(repair_json(txt))
+        return (js, True) if isinstance(js, dict) else (None, True)
+    except json.JSONDecodeError:
+        return None, True
+
+def judge(jm):
+    """採点を実行（修復できない場合のみ、もう一度問い合わせる）"""
+    for attempt in range(2):
+        jr = client.chat.completions.create(model=JUDGE_MODEL, messages=jm)
+        txt = jr.choices[0].message.content or "{}"
+        js, repaired = parse_judge(txt)
+        if js is not None:
+            parse_stats["reasked" if attempt else "repaired" if repaired else "ok"] += 1
+            return js
+        jm = jm + [{"role":"assistant","content":txt},
+                   {"role":"user","content":"The output was not valid JSON. Return JSON only with keys: score, reasoning."}]
+    parse_stats["failed"] += 1
+    return {"score": 0.0}
+
 for item in dataset.items:
     with item.run(run_name=RUN_NAME) as root:
         p = lf.get_prompt(PROMPT_NAME, type=PROMPT_TYPE)
@@ -36,12 +141,14 @@ for item in dataset.items:
             {"role":"system","content":rubric},
             {"role":"user","content":f"Expected:\n{expected}\n\nAnswer:\n{pred}\n\nReturn JSON only."}
         ]
-        jr = client.chat.completions.create(model=JUDGE_MODEL, messages=jm)
-        txt = jr.choices[0].message.content or "{}"
-        m = re.search(r"\{.*\}", txt, re.S)
-        js = json.loads(m.group(0)) if m else {"score":0.0}
-        score = float(js.get("score",0.0))
+        js = judge(jm)
+        try:
+            score = float(js.get("score",0.0))
+        except (TypeError, ValueError):
+            score = 0.0
         root.score_trace(name="judge_score", value=score)
         root.score_trace(name="judge_pass", value=1.0 if score>=PASS_THRESHOLD else 0.0)
+total = sum(parse_stats.values()) or 1
+print("judge parse:", parse_stats, f"repair_rate={parse_stats['repaired']/total:.2f}", f"reask_rate={parse_stats['reasked']/total:.2f}")
 print("done:", RUN_NAME)
 